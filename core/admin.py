@@ -7,9 +7,12 @@ from django.db.models.functions import Coalesce
 
 from core.models import (
     Event, EventMessageTemplate, TgOutboxMessage,
-    TgUser, Ticket, Payment, PromoCode, TgBroadcast
+    TgUser, Ticket, Payment, PromoCode, TgBroadcast, AudienceSegment
 )
-from core.services.broadcast import enqueue_broadcast
+from core.services.broadcast import cancel_broadcast, pause_broadcast, resume_broadcast
+from core.services.broadcast_progress import get_broadcast_progress
+from core.services.segments import audience_size, refresh_segment
+from core.tasks import enqueue_broadcast_task
 
 
 PAID_STATUS = "paid"
@@ -99,4 +102,80 @@ class EventAdmin(admin.ModelAdmin):
         denom = obj.tickets_count_a or 0
         if denom == 0:
             return "—"
-        return f"{(obj.paid_users_count_a * 100) / denom:.1f}%"
\ No newline at end of file
+        return f"{(obj.paid_users_count_a * 100) / denom:.1f}%"
+
+
+@admin.register(TgBroadcast)
+class TgBroadcastAdmin(admin.ModelAdmin):
+    list_display = (
+        "id", "title", "segment", "audience", "delivery_mode", "state", "event", "created_at",
+        "enqueue_status", "enqueued_count", "enqueued_at", "progress",
+    )
+    list_filter = ("segment", "delivery_mode", "state", "enqueue_status")
+    readonly_fields = (
+        "state", "progress",
+        "enqueue_status", "enqueue_cursor", "enqueued_count",
+        "enqueued_at", "enqueue_finished_at", "enqueue_error",
+        "delivery_cursor", "sent_count", "failed_count", "delivery_finished_at",
+    )
+    actions = ("enqueue_selected", "pause_selected", "resume_selected", "cancel_selected")
+
+    @admin.display(description="Progress")
+    def progress(self, obj):
+        if obj.enqueue_status == TgBroadcast.EnqueueStatus.IDLE:
+            return "—"
+        p = get_broadcast_progress(obj)
+        text = f"sent {p['sent']} · failed {p['failed']} · left {p['remaining']} · {p['rate_per_s']}/s"
+        if p["eta_s"] is not None:
+            text += f" · ETA {p['eta_s'] // 60}m{p['eta_s'] % 60:02d}s"
+        return text
+
+    @admin.action(description="Поставити розсилку в чергу")
+    def enqueue_selected(self, request, queryset):
+        started = 0
+        for b in queryset.exclude(enqueue_status__in=[
+            TgBroadcast.EnqueueStatus.QUEUED,
+            TgBroadcast.EnqueueStatus.RUNNING,
+            TgBroadcast.EnqueueStatus.DONE,
+        ]):
+            TgBroadcast.objects.filter(pk=b.pk).update(enqueue_status=TgBroadcast.EnqueueStatus.QUEUED)
+            enqueue_broadcast_task.delay(b.pk)
+            started += 1
+        self.message_user(request, f"Поставлено в чергу: {started}", messages.SUCCESS)
+
+    @admin.action(description="Пауза")
+    def pause_selected(self, request, queryset):
+        for b in queryset.filter(state=TgBroadcast.State.ACTIVE):
+            pause_broadcast(b)
+        self.message_user(request, "Розсилки поставлено на паузу", messages.SUCCESS)
+
+    @admin.action(description="Продовжити")
+    def resume_selected(self, request, queryset):
+        for b in queryset.filter(state=TgBroadcast.State.PAUSED):
+            resume_broadcast(b)
+        self.message_user(request, "Розсилки продовжено", messages.SUCCESS)
+
+    @admin.action(description="Скасувати")
+    def cancel_selected(self, request, queryset):
+        for b in queryset.exclude(state=TgBroadcast.State.CANCELLED):
+            cancel_broadcast(b)
+        self.message_user(request, "Розсилки скасовано", messages.WARNING)
+
+
+@admin.register(AudienceSegment)
+class AudienceSegmentAdmin(admin.ModelAdmin):
+    list_display = ("id", "name", "is_materialized", "member_count", "refreshed_at", "size")
+    readonly_fields = ("member_count", "refreshed_at", "size")
+    actions = ("refresh_selected",)
+
+    @admin.display(description="Audience size")
+    def size(self, obj):
+        if obj.pk is None:
+            return "—"
+        return audience_size(obj)
+
+    @admin.action(description="Оновити учасників (матеріалізовані)")
+    def refresh_selected(self, request, queryset):
+        for seg in queryset.filter(is_materialized=True):
+            refresh_segment(seg)
+        self.message_user(request, "Сегменти оновлено", messages.SUCCESS)
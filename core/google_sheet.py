@@ -3,11 +3,18 @@ import os
 import json
 import base64
 import logging
+import re
+import threading
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Callable, List, TypeVar
 
 import gspread
+from google.auth.exceptions import RefreshError
+from django.conf import settings
 from google.oauth2.service_account import Credentials
+from gspread.utils import rowcol_to_a1
+
+from core.services.rate_limit import get_sheets_rate_limiter
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +23,31 @@ SCOPES = [
     "https://www.googleapis.com/auth/drive",
 ]
 
+T = TypeVar("T")
+
+# Клієнт, таблиця і worksheet'и кешуються на процес (після fork у Celery-воркері — свої):
+# креденшали, OAuth-обмін і open_by_key робляться один раз, а не на кожен рядок.
+# Токен клієнт оновлює сам (AuthorizedSession), а на auth-помилці кеш скидається.
+# worksheets / row_indexes — по назві аркуша (None — sheet1);
+# row_index — payment_id -> номер рядка в аркуші, щоб експорт був upsert, а не дубль
+_cache: Dict[str, Any] = {
+    "pid": None, "sheet_id": None, "client": None, "spreadsheet": None,
+    "worksheets": {}, "row_indexes": {},
+}
+_cache_lock = threading.Lock()
+
+# колонка payment_id у registration_row() (1-based) і ширина рядка
+PAYMENT_ID_COL = 8
+ROW_WIDTH = 9
+HEADER_ROW = ["tg_id", "username", "full_name", "age", "phone", "email", "event", "payment_id", "paid_at"]
+
+_UPDATED_RANGE_RE = re.compile(r"![A-Z]+(\d+)")
+
+
+class SheetsQuotaExceeded(RuntimeError):
+    """Квоти Sheets API зараз немає (ліміт або 429/503) — запит варто повторити пізніше."""
+
+
 def _load_service_account_info() -> dict:
     """
     1) GOOGLE_CREDS_B64 (base64 of json)
@@ -52,15 +84,149 @@ def _get_gspread_client() -> gspread.Client:
     return gspread.authorize(credentials)
 
 
-def send_registration_to_google_sheets(data: Dict[str, Any]) -> None:
+def _get_sheet_id() -> str:
     sheet_id = (os.getenv("GOOGLE_SHEET_ID") or "").strip()
     if not sheet_id:
         raise RuntimeError("GOOGLE_SHEET_ID not set")
+    return sheet_id
+
+
+def event_worksheet_title(event_id: Optional[int]) -> Optional[str]:
+    """Окремий аркуш на кожен Event; назва за id, щоб не залежати від перейменувань."""
+    return f"event-{event_id}" if event_id else None
+
+
+def _get_spreadsheet() -> gspread.Spreadsheet:
+    """Закешована (на процес) таблиця GOOGLE_SHEET_ID; open_by_key — в межах квоти."""
+    sheet_id = _get_sheet_id()
+    pid = os.getpid()
+    with _cache_lock:
+        if _cache["pid"] == pid and _cache["sheet_id"] == sheet_id and _cache["spreadsheet"] is not None:
+            return _cache["spreadsheet"]
 
     client = _get_gspread_client()
-    sheet = client.open_by_key(sheet_id).sheet1
+    spreadsheet = _call_within_quota(lambda: client.open_by_key(sheet_id))
+    with _cache_lock:
+        _cache.update(
+            pid=pid,
+            sheet_id=sheet_id,
+            client=client,
+            spreadsheet=spreadsheet,
+            worksheets={},
+            row_indexes={},
+        )
+    logger.info("Google Sheets: client initialized | pid=%s", pid)
+    return spreadsheet
+
+
+def _open_or_create_worksheet(spreadsheet: gspread.Spreadsheet, title: str) -> gspread.Worksheet:
+    try:
+        return _call_within_quota(lambda: spreadsheet.worksheet(title))
+    except gspread.exceptions.WorksheetNotFound:
+        pass
+    try:
+        ws = _call_within_quota(lambda: spreadsheet.add_worksheet(title=title, rows=1000, cols=ROW_WIDTH))
+    except gspread.exceptions.APIError as e:
+        if not _is_already_exists_error(e):
+            raise
+        # паралельний воркер створив аркуш між нашими запитами
+        return _call_within_quota(lambda: spreadsheet.worksheet(title))
+    _call_within_quota(lambda: ws.append_row(HEADER_ROW, value_input_option="RAW"))
+    logger.info("Google Sheets: worksheet created | title=%s", title)
+    return ws
+
+
+def get_worksheet(title: Optional[str] = None) -> gspread.Worksheet:
+    """
+    Закешований (на процес) аркуш таблиці GOOGLE_SHEET_ID: title=None — sheet1,
+    інакше аркуш з такою назвою (створюється з рядком заголовків при першому зверненні).
+    Запити до API при промаху кешу — теж через SheetsRateLimiter.
+    """
+    spreadsheet = _get_spreadsheet()
+    with _cache_lock:
+        ws = _cache["worksheets"].get(title)
+    if ws is not None:
+        return ws
+
+    if title is None:
+        ws = _call_within_quota(lambda: spreadsheet.sheet1)
+    else:
+        ws = _open_or_create_worksheet(spreadsheet, title)
+    with _cache_lock:
+        return _cache["worksheets"].setdefault(title, ws)
+
+
+def invalidate_sheets_cache() -> None:
+    with _cache_lock:
+        _cache.update(pid=None, sheet_id=None, client=None, spreadsheet=None, worksheets={}, row_indexes={})
+
+
+def invalidate_row_indexes() -> None:
+    """
+    Скидає індекси payment_id -> рядок: наступний upsert перечитає колонку payment_id.
+    Викликається на початку кожного експорту — аркуш могли доповнити інші воркери
+    або відсортувати / почистити вручну, і старі номери рядків тоді вказують не туди.
+    """
+    with _cache_lock:
+        _cache["row_indexes"] = {}
+
+
+def _is_auth_error(e: Exception) -> bool:
+    if isinstance(e, RefreshError):
+        return True
+    return isinstance(e, gspread.exceptions.APIError) and e.code in (401, 403)
 
-    row = [
+
+def _is_quota_error(e: Exception) -> bool:
+    return isinstance(e, gspread.exceptions.APIError) and e.code in (429, 503)
+
+
+def _is_already_exists_error(e: Exception) -> bool:
+    return (
+        isinstance(e, gspread.exceptions.APIError)
+        and e.code == 400
+        and "already exists" in str(e).lower()
+    )
+
+
+def _call_within_quota(fn: Callable[[], T]) -> T:
+    """Один запит до Sheets API: токен з SheetsRateLimiter, 429/503 -> SheetsQuotaExceeded."""
+    limiter = get_sheets_rate_limiter()
+    if not limiter.acquire(settings.SHEETS_MAX_WAIT_SECONDS):
+        raise SheetsQuotaExceeded("Sheets API quota exhausted, try later")
+    try:
+        result = fn()
+    except Exception as e:
+        if _is_quota_error(e):
+            limiter.on_quota_error()
+            raise SheetsQuotaExceeded(str(e)) from e
+        raise
+    limiter.on_success()
+    return result
+
+
+def with_worksheet(fn: Callable[[gspread.Worksheet], T], title: Optional[str] = None) -> T:
+    """
+    Виконує fn(worksheet) на закешованому аркуші `title` в межах квоти (SheetsRateLimiter).
+    Auth-помилка (протухли/відкликали креденшали, забрали доступ) — скидає кеш і пробує ще раз з нуля.
+    429/503 — спільна пауза для всіх воркерів і SheetsQuotaExceeded.
+    """
+    def call() -> T:
+        ws = get_worksheet(title)
+        return _call_within_quota(lambda: fn(ws))
+
+    try:
+        return call()
+    except Exception as e:
+        if not _is_auth_error(e):
+            raise
+        logger.warning("Google Sheets: auth error, re-authorizing | %s", e)
+        invalidate_sheets_cache()
+        return call()
+
+
+def registration_row(data: Dict[str, Any]) -> list:
+    return [
         str(data.get("tg_id", "")),
         data.get("username", "") or "",
         data.get("full_name", "") or "",
@@ -70,7 +236,75 @@ def send_registration_to_google_sheets(data: Dict[str, Any]) -> None:
         data.get("event", "") or "",
         str(data.get("payment_id", "") or ""),
         data.get("paid_at", "") or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        ]
+    ]
+
+
+def get_row_index(title: Optional[str] = None) -> Dict[str, int]:
+    """
+    payment_id -> номер рядка аркуша `title`. Читається одним запитом (одна колонка) після
+    invalidate_row_indexes(), далі доповнюється після кожного append — без повторного читання аркуша.
+    """
+    _get_spreadsheet()  # скидає індекси разом з кешем, якщо змінився процес / таблиця
+    index = _cache["row_indexes"].get(title)
+    if index is None:
+        values = with_worksheet(lambda ws: ws.col_values(PAYMENT_ID_COL), title)
+        index = {v: i for i, v in enumerate(values, start=1) if v}
+        # після ре-авторизації в with_worksheet кеш уже новий — пишемо в актуальний
+        _cache["row_indexes"][title] = index
+        logger.info("Google Sheets: row index loaded | sheet=%s | rows=%s", title or "sheet1", len(index))
+    return index
+
+
+def _first_appended_row(response: Any) -> Optional[int]:
+    # append повертає {"updates": {"updatedRange": "'Sheet1'!A12:I14", ...}}
+    updated = ((response or {}).get("updates") or {}).get("updatedRange") or ""
+    m = _UPDATED_RANGE_RE.search(updated)
+    return int(m.group(1)) if m else None
+
+
+def upsert_registrations(rows: List[list], title: Optional[str] = None) -> Dict[str, int]:
+    """
+    Пише рядки registration_row() в аркуш `title` (None — sheet1):
+    ті, чий payment_id уже є в аркуші, перезаписуються на місці
+    (один batch_update), решта додаються одним append_rows. Повторний експорт того самого платежу
+    (впав save після append) не створює дубль. Свіжість індексу — на тому, хто викликає
+    (invalidate_row_indexes() на початку експорту).
+    """
+    if not rows:
+        return {"appended": 0, "updated": 0}
+
+    index = get_row_index(title)
+    updates = []
+    new_rows = []
+    for row in rows:
+        payment_id = row[PAYMENT_ID_COL - 1]
+        existing = index.get(payment_id) if payment_id else None
+        if existing:
+            rng = f"{rowcol_to_a1(existing, 1)}:{rowcol_to_a1(existing, ROW_WIDTH)}"
+            updates.append({"range": rng, "values": [row]})
+        else:
+            new_rows.append(row)
+
+    if updates:
+        with_worksheet(lambda ws: ws.batch_update(updates, value_input_option="USER_ENTERED"), title)
+        logger.info("Google Sheets: updated existing rows | sheet=%s | rows=%s", title or "sheet1", len(updates))
+
+    if new_rows:
+        response = with_worksheet(lambda ws: ws.append_rows(new_rows, value_input_option="USER_ENTERED"), title)
+        first = _first_appended_row(response)
+        if first is None:
+            # не знаємо, куди лягли рядки — перечитаємо індекс при наступному експорті
+            _cache["row_indexes"].pop(title, None)
+        else:
+            for offset, row in enumerate(new_rows):
+                if row[PAYMENT_ID_COL - 1]:
+                    index[row[PAYMENT_ID_COL - 1]] = first + offset
+        logger.info("Google Sheets: saved batch | sheet=%s | rows=%s", title or "sheet1", len(new_rows))
 
-    sheet.append_row(row, value_input_option="USER_ENTERED")
+    return {"appended": len(new_rows), "updated": len(updates)}
+
+
+def send_registration_to_google_sheets(data: Dict[str, Any]) -> None:
+    invalidate_row_indexes()
+    upsert_registrations([registration_row(data)], event_worksheet_title(data.get("event_id")))
     logger.info("Google Sheets: saved | tg_id=%s payment_id=%s", data.get("tg_id"), data.get("payment_id"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from core.services.outbox_scheduler import run_outbox_dispatcher
+
+
+class Command(BaseCommand):
+    help = "Run the low-latency outbox dispatcher (wakes up exactly when TgOutboxMessage.run_at is due)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=200, help="batch size")
+        parser.add_argument("--max-seconds", type=float, default=55,
+                            help="max duration of one drain before re-checking the schedule")
+
+    def handle(self, *args, **options):
+        run_outbox_dispatcher(batch_size=options["limit"], max_drain_seconds=options["max_seconds"])
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from core.tasks import outbox_tick
+
+
+class Command(BaseCommand):
+    help = "Send pending TgOutboxMessage now"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=200, help="batch size")
+        parser.add_argument("--until-empty", action="store_true",
+                            help="keep sending batches until nothing is due")
+        parser.add_argument("--max-seconds", type=float, default=None,
+                            help="stop draining after this many seconds")
+
+    def handle(self, *args, **options):
+        limit = options["limit"]
+        max_seconds = options["max_seconds"]
+        if options["until_empty"] and max_seconds is None:
+            max_seconds = 0  # 0 — без обмеження часу
+
+        res = outbox_tick(limit=limit, max_seconds=max_seconds)  # синхронно
+        if res.get("skipped"):
+            self.stdout.write(self.style.WARNING("Skipped | all drainer slots are busy"))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Done | total={res['total']} sent={res['sent']} failed={res['failed']} "
+            f"retry={res['retry']} dead={res['dead']} rate={res['rate_per_s']}/s"
+        ))
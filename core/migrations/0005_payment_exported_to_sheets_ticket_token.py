@@ -0,0 +1,30 @@
+# Generated by Django 5.2.9 on 2026-10-17 11:17
+
+import core.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    Розбіжність моделей і міграцій, що була ще до outbox-змін: код уже використовує
+    Payment.exported_to_sheets, тож на живих базах колонка може вже існувати.
+    Тоді цю міграцію застосовують з --fake:
+        python manage.py migrate core 0005_payment_exported_to_sheets_ticket_token --fake
+    """
+
+    dependencies = [
+        ('core', '0004_remove_event_banner_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='exported_to_sheets',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.AlterField(
+            model_name='ticket',
+            name='token',
+            field=models.CharField(default=core.models.gen_token, editable=False, max_length=64, unique=True),
+        ),
+    ]
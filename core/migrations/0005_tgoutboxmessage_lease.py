@@ -0,0 +1,23 @@
+# Generated by Django 5.2.9 on 2026-10-17 11:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_payment_exported_to_sheets_ticket_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tgoutboxmessage',
+            name='claimed_by',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='tgoutboxmessage',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
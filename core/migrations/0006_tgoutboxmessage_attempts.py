@@ -0,0 +1,23 @@
+# Generated by Django 5.2.9 on 2026-10-17 11:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_tgoutboxmessage_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tgoutboxmessage',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='tgoutboxmessage',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed'), ('dead', 'Dead (max attempts)')], default='pending', max_length=16),
+        ),
+    ]
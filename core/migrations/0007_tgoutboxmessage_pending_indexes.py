@@ -0,0 +1,21 @@
+# Generated by Django 5.2.9 on 2026-10-17 11:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_tgoutboxmessage_attempts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='tgoutboxmessage',
+            index=models.Index(fields=['status', 'run_at'], name='outbox_status_run_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tgoutboxmessage',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['run_at'], name='outbox_pending_run_at_idx'),
+        ),
+    ]
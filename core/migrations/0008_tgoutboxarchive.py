@@ -0,0 +1,29 @@
+# Generated by Django 5.2.9 on 2026-10-17 11:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_tgoutboxmessage_pending_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TgOutboxArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('tg_id', models.BigIntegerField(db_index=True)),
+                ('event_id', models.BigIntegerField(blank=True, null=True)),
+                ('trigger', models.CharField(max_length=64)),
+                ('status', models.CharField(max_length=16)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error', models.CharField(blank=True, default='', max_length=255)),
+                ('run_at', models.DateTimeField()),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
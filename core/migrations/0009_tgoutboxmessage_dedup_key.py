@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-17 11:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_tgoutboxarchive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tgoutboxmessage',
+            name='dedup_key',
+            field=models.CharField(blank=True, max_length=128, null=True, unique=True),
+        ),
+    ]
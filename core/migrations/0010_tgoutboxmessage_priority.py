@@ -0,0 +1,26 @@
+# Generated by Django 5.2.9 on 2026-10-17 11:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_tgoutboxmessage_dedup_key'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='tgoutboxmessage',
+            name='outbox_pending_run_at_idx',
+        ),
+        migrations.AddField(
+            model_name='tgoutboxmessage',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Transactional'), (1, 'Triggered'), (2, 'Broadcast')], default=1),
+        ),
+        migrations.AddIndex(
+            model_name='tgoutboxmessage',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['priority', 'run_at'], name='outbox_pending_prio_run_at_idx'),
+        ),
+    ]
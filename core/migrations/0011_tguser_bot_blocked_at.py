@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-17 11:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_tgoutboxmessage_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tguser',
+            name='bot_blocked_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
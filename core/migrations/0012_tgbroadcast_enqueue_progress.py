@@ -0,0 +1,44 @@
+# Generated by Django 5.2.9 on 2026-10-17 11:31
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_enqueued_done(apps, schema_editor):
+    # розсилки, поставлені в чергу до цієї міграції, вже відправлені — адмін-дія не має слати їх знову
+    TgBroadcast = apps.get_model("core", "TgBroadcast")
+    TgBroadcast.objects.filter(enqueued_at__isnull=False).update(
+        enqueue_status="done",
+        enqueue_finished_at=F("enqueued_at"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_tguser_bot_blocked_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tgbroadcast',
+            name='enqueue_cursor',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tgbroadcast',
+            name='enqueue_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='tgbroadcast',
+            name='enqueue_finished_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tgbroadcast',
+            name='enqueue_status',
+            field=models.CharField(choices=[('idle', 'Not enqueued'), ('queued', 'Queued'), ('running', 'Enqueueing'), ('done', 'Enqueued'), ('failed', 'Failed')], default='idle', max_length=10),
+        ),
+        migrations.RunPython(mark_enqueued_done, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.9 on 2026-10-17 11:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_tgbroadcast_enqueue_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tgbroadcast',
+            name='delivery_cursor',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tgbroadcast',
+            name='delivery_finished_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tgbroadcast',
+            name='delivery_mode',
+            field=models.CharField(choices=[('outbox', 'Outbox row per recipient'), ('lazy', 'Lazy fan-out')], default='outbox', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='tgbroadcast',
+            name='failed_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tgbroadcast',
+            name='sent_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='TgBroadcastFailure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tg_id', models.BigIntegerField()),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('broadcast', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='failures', to='core.tgbroadcast')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('broadcast', 'tg_id'), name='uniq_broadcast_failure')],
+            },
+        ),
+    ]
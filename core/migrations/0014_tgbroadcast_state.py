@@ -0,0 +1,29 @@
+# Generated by Django 5.2.9 on 2026-10-17 11:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_tgbroadcast_lazy_delivery'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tgbroadcast',
+            name='state',
+            field=models.CharField(choices=[('active', 'Active'), ('paused', 'Paused'), ('cancelled', 'Cancelled')], default='active', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='tgoutboxmessage',
+            name='broadcast',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.tgbroadcast'),
+        ),
+        migrations.AlterField(
+            model_name='tgoutboxmessage',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed'), ('dead', 'Dead (max attempts)'), ('paused', 'Paused'), ('cancelled', 'Cancelled')], default='pending', max_length=16),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.9 on 2026-10-17 11:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_tgbroadcast_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AudienceSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=120, unique=True)),
+                ('definition', models.JSONField(default=dict)),
+                ('is_materialized', models.BooleanField(default=False)),
+                ('member_count', models.PositiveIntegerField(default=0)),
+                ('refreshed_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='tgbroadcast',
+            name='audience',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.audiencesegment'),
+        ),
+        migrations.CreateModel(
+            name='SegmentMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('added_at', models.DateTimeField(auto_now_add=True)),
+                ('segment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='core.audiencesegment')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='segment_memberships', to='core.tguser')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('segment', 'user'), name='uniq_segment_member')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.9 on 2026-10-17 11:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_audiencesegment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tgbroadcast',
+            name='send_duration_seconds',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tgbroadcast',
+            name='send_rate',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tgbroadcast',
+            name='send_start_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.9 on 2026-10-17 11:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_tgbroadcast_pacing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SheetsExportQueue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('payment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='sheets_export', to='core.payment')),
+            ],
+        ),
+    ]
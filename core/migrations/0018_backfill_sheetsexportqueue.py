@@ -0,0 +1,35 @@
+from django.db import migrations
+
+
+def backfill(apps, schema_editor):
+    Payment = apps.get_model("core", "Payment")
+    SheetsExportQueue = apps.get_model("core", "SheetsExportQueue")
+
+    ids = (
+        Payment.objects
+        .filter(
+            status="success",
+            user__isnull=False,
+            exported_to_sheets=False,
+            provider="monobank",
+            amount__gt=0,
+        )
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+    SheetsExportQueue.objects.bulk_create(
+        [SheetsExportQueue(payment_id=pid) for pid in ids.iterator()],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_sheetsexportqueue'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
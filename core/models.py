@@ -1,3 +1,4 @@
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils import timezone
 
@@ -13,6 +14,8 @@ class TgUser(models.Model):
     email = models.EmailField()
 
     has_paid_once = models.BooleanField(default=False, db_index=True)
+    # Telegram відповів 403 (бот заблокований / акаунт видалено): не шлемо, поки юзер не повернеться
+    bot_blocked_at = models.DateTimeField(null=True, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -79,25 +82,98 @@ class TgOutboxMessage(models.Model):
         PENDING = "pending", "Pending"
         SENT = "sent", "Sent"
         FAILED = "failed", "Failed"
+        DEAD = "dead", "Dead (max attempts)"
+        # розсилку поставили на паузу / скасували (TgBroadcast.state)
+        PAUSED = "paused", "Paused"
+        CANCELLED = "cancelled", "Cancelled"
+
+    class Priority(models.IntegerChoices):
+        # менше значення — раніше відправляється
+        TRANSACTIONAL = 0, "Transactional"
+        TRIGGERED = 1, "Triggered"
+        BROADCAST = 2, "Broadcast"
+
+    TRANSACTIONAL_TRIGGERS = (
+        EventMessageTemplate.Trigger.AFTER_PAYMENT_SUCCESS,
+        EventMessageTemplate.Trigger.AFTER_TICKET_SENT,
+    )
 
     tg_id = models.BigIntegerField(db_index=True)
 
     # ✅ ВАЖЛИВО: робимо event необовʼязковим для broadcast-розсилок
     event = models.ForeignKey(Event, on_delete=models.SET_NULL, null=True, blank=True)
+    broadcast = models.ForeignKey("TgBroadcast", on_delete=models.SET_NULL, null=True, blank=True)
 
     trigger = models.CharField(max_length=64, db_index=True)
     text = models.TextField()
 
     run_at = models.DateTimeField(db_index=True)
     status = models.CharField(max_length=16, choices=Status.choices, default=Status.PENDING)
+    priority = models.PositiveSmallIntegerField(choices=Priority.choices, default=Priority.TRIGGERED)
 
     sent_at = models.DateTimeField(null=True, blank=True)
     error = models.TextField(blank=True, default="")
+    attempts = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # lease: воркер, що взяв повідомлення в роботу, і до коли воно за ним.
+    # Якщо воркер впав — після lease_expires_at повідомлення бере інший.
+    claimed_by = models.CharField(max_length=64, blank=True, default="")
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+
+    # для тригерних повідомлень: event:tg_id:trigger:template — повторний тригер не створить дубль.
+    # NULL (broadcast тощо) унікальність не обмежує.
+    dedup_key = models.CharField(max_length=128, null=True, blank=True, unique=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "run_at"], name="outbox_status_run_at_idx"),
+            # гаряча черга: pending + priority + run_at <= now, order by run_at — не торкається sent/failed
+            models.Index(
+                fields=["priority", "run_at"],
+                condition=models.Q(status="pending"),
+                name="outbox_pending_prio_run_at_idx",
+            ),
+        ]
+
     def __str__(self):
         return f"{self.tg_id} | {self.trigger} | {self.status}"
 
+    @staticmethod
+    def make_dedup_key(event_id, tg_id, trigger, template_id) -> str:
+        return f"{event_id}:{tg_id}:{trigger}:{template_id}"
+
+    @classmethod
+    def priority_for_trigger(cls, trigger: str) -> int:
+        if trigger in cls.TRANSACTIONAL_TRIGGERS:
+            return cls.Priority.TRANSACTIONAL
+        return cls.Priority.TRIGGERED
+
+
+class TgOutboxArchive(models.Model):
+    """
+    Компактний архів відправлених / невдалих TgOutboxMessage (без тексту),
+    щоб жива черга лишалась маленькою. id — той самий, що був у TgOutboxMessage.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    tg_id = models.BigIntegerField(db_index=True)
+    event_id = models.BigIntegerField(null=True, blank=True)
+    trigger = models.CharField(max_length=64)
+    status = models.CharField(max_length=16)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.CharField(max_length=255, blank=True, default="")
+
+    run_at = models.DateTimeField()
+    sent_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    # dedup_key переїжджає разом з рядком: повторний тригер після архівації теж не має створити дубль
+    dedup_key = models.CharField(max_length=128, null=True, blank=True, unique=True)
+
+    def __str__(self):
+        return f"{self.tg_id} | {self.trigger} | {self.status} (archived)"
+
 
 # ================= PROMOCODES =================
 
@@ -154,6 +230,18 @@ class Payment(models.Model):
         return f"Payment #{self.id} ({self.status})"
 
 
+class SheetsExportQueue(models.Model):
+    """
+    Черга експорту в Google Sheets: рядок додається, коли платіж стає success,
+    і видаляється після експорту. Експортер читає тільки її, а не весь Payment.
+    """
+    payment = models.OneToOneField(Payment, on_delete=models.CASCADE, related_name="sheets_export")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Export payment #{self.payment_id}"
+
+
 # ================= TICKETS =================
 
 def gen_token():
@@ -170,6 +258,50 @@ class Ticket(models.Model):
         return f"Ticket #{self.id} for {self.user_id}"
 
 
+# ================= AUDIENCE SEGMENTS =================
+
+class AudienceSegment(models.Model):
+    """
+    Аудиторія розсилки, описана JSON-правилами (див. core/services/segments.py), напр.:
+        {"all": [{"payment_started": {"event": 5}}, {"not": {"paid": {"event": 5}}}]}
+    Матеріалізований сегмент тримає список учасників у SegmentMembership
+    і оновлюється диффом (refresh_segment), а не перераховується на кожну розсилку.
+    """
+    name = models.CharField(max_length=120, unique=True)
+    definition = models.JSONField(default=dict)
+    is_materialized = models.BooleanField(default=False)
+
+    member_count = models.PositiveIntegerField(default=0)
+    refreshed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def clean(self):
+        from core.services.segments import SegmentError, compile_segment
+
+        try:
+            compile_segment(self.definition)
+        except SegmentError as e:
+            raise ValidationError({"definition": str(e)})
+
+    def __str__(self):
+        return self.name
+
+
+class SegmentMembership(models.Model):
+    segment = models.ForeignKey(AudienceSegment, on_delete=models.CASCADE, related_name="memberships")
+    user = models.ForeignKey(TgUser, on_delete=models.CASCADE, related_name="segment_memberships")
+    added_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            # (segment, user) — і унікальність, і індекс для вибірки сегмента по user_id
+            models.UniqueConstraint(fields=["segment", "user"], name="uniq_segment_member"),
+        ]
+
+    def __str__(self):
+        return f"{self.segment_id}:{self.user_id}"
+
+
 # ================= BROADCAST =================
 
 class TgBroadcast(models.Model):
@@ -177,8 +309,36 @@ class TgBroadcast(models.Model):
         ALL = "all", "All users"
         PAID = "paid", "Paid users"
 
+    class DeliveryMode(models.TextChoices):
+        # рядок TgOutboxMessage на кожного отримувача
+        OUTBOX = "outbox", "Outbox row per recipient"
+        # текст один раз, отримувачі перебираються курсором під час відправки
+        LAZY = "lazy", "Lazy fan-out"
+
+    class State(models.TextChoices):
+        ACTIVE = "active", "Active"
+        PAUSED = "paused", "Paused"
+        CANCELLED = "cancelled", "Cancelled"
+
+    class EnqueueStatus(models.TextChoices):
+        IDLE = "idle", "Not enqueued"
+        QUEUED = "queued", "Queued"
+        RUNNING = "running", "Enqueueing"
+        DONE = "done", "Enqueued"
+        FAILED = "failed", "Failed"
+
     title = models.CharField(max_length=120, blank=True, default="")
     segment = models.CharField(max_length=10, choices=Segment.choices, default=Segment.ALL)
+    # якщо задано — аудиторія береться з сегмента, а не з segment
+    audience = models.ForeignKey(AudienceSegment, on_delete=models.SET_NULL, null=True, blank=True)
+
+    # розподіл у часі: перше повідомлення о send_start_at (порожньо — одразу),
+    # решта рівномірно на send_duration_seconds або з темпом send_rate msg/s (порожньо — все одразу)
+    send_start_at = models.DateTimeField(null=True, blank=True)
+    send_duration_seconds = models.PositiveIntegerField(null=True, blank=True)
+    send_rate = models.FloatField(null=True, blank=True)
+    delivery_mode = models.CharField(max_length=10, choices=DeliveryMode.choices, default=DeliveryMode.OUTBOX)
+    state = models.CharField(max_length=10, choices=State.choices, default=State.ACTIVE)
     text = models.TextField()
 
     event = models.ForeignKey(Event, on_delete=models.SET_NULL, null=True, blank=True)
@@ -187,5 +347,40 @@ class TgBroadcast(models.Model):
     enqueued_count = models.PositiveIntegerField(default=0)
     enqueued_at = models.DateTimeField(null=True, blank=True)
 
+    # прогрес поставлення в чергу (задача enqueue_broadcast_task)
+    enqueue_status = models.CharField(max_length=10, choices=EnqueueStatus.choices, default=EnqueueStatus.IDLE)
+    # останній TgUser.id, для якого вже створено повідомлення — з нього продовжуємо після збою
+    enqueue_cursor = models.BigIntegerField(default=0)
+    enqueue_finished_at = models.DateTimeField(null=True, blank=True)
+    enqueue_error = models.TextField(blank=True, default="")
+
+    # lazy fan-out: останній TgUser.id, якого вже взяв у роботу відправник
+    delivery_cursor = models.BigIntegerField(default=0)
+    sent_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    delivery_finished_at = models.DateTimeField(null=True, blank=True)
+
+    def clean(self):
+        if self.send_duration_seconds and self.send_rate:
+            raise ValidationError("Вкажіть або тривалість, або темп розсилки, не обидва.")
+        if self.send_rate is not None and self.send_rate <= 0:
+            raise ValidationError({"send_rate": "Темп має бути більшим за 0."})
+
     def __str__(self):
         return self.title or f"Broadcast #{self.pk}"
+
+
+class TgBroadcastFailure(models.Model):
+    """Невдалі доставки lazy-розсилки: зберігаємо тільки їх, успіхи — лічильником у TgBroadcast."""
+    broadcast = models.ForeignKey(TgBroadcast, on_delete=models.CASCADE, related_name="failures")
+    tg_id = models.BigIntegerField()
+    error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["broadcast", "tg_id"], name="uniq_broadcast_failure"),
+        ]
+
+    def __str__(self):
+        return f"{self.broadcast_id}:{self.tg_id}"
@@ -1,54 +1,208 @@
 import logging
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional, Tuple
+
 from django.db import transaction
+from django.db.models import F, QuerySet
 from django.utils import timezone
 
 from core.models import TgUser, TgOutboxMessage, TgBroadcast
+from core.services.outbox_scheduler import notify_outbox_scheduled
+from core.services.segments import segment_users
 
 logger = logging.getLogger(__name__)
 
+ENQUEUE_CHUNK_SIZE = 1000
 
-def enqueue_broadcast(broadcast: TgBroadcast, *, trigger: str = "admin_broadcast") -> int:
-    qs = TgUser.objects.all()
-    if broadcast.segment == TgBroadcast.Segment.PAID:
-        qs = qs.filter(has_paid_once=True)
-    tg_ids = list(qs.values_list("tg_id", flat=True))
-    if not tg_ids:
-        logger.info("enqueue_broadcast: no recipients | broadcast_id=%s", broadcast.id)
-        broadcast.enqueued_count = 0
-        broadcast.enqueued_at = timezone.now()
-        broadcast.save(update_fields=["enqueued_count", "enqueued_at"])
-        return 0
 
-    now = timezone.now()
+def broadcast_recipients(broadcast: TgBroadcast) -> QuerySet:
+    if broadcast.audience_id:
+        qs = segment_users(broadcast.audience)
+    else:
+        qs = TgUser.objects.all()
+        if broadcast.segment == TgBroadcast.Segment.PAID:
+            qs = qs.filter(has_paid_once=True)
+    # хто заблокував бота, однаково отримає 403 — не ставимо їх у чергу
+    return qs.filter(bot_blocked_at__isnull=True)
+
+
+def iter_recipient_chunks(qs: QuerySet, *, after_id: int = 0, chunk_size: int = ENQUEUE_CHUNK_SIZE) -> Iterator[List[Tuple[int, int]]]:
+    """
+    Keyset-пагінація по TgUser.id: віддає шматки [(id, tg_id)] по chunk_size,
+    не тримаючи в памʼяті всю аудиторію і без OFFSET.
+    """
+    while True:
+        chunk = list(qs.filter(id__gt=after_id).order_by("id").values_list("id", "tg_id")[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        after_id = chunk[-1][0]
+
+
+def send_interval(total: int, *, duration: Optional[float] = None, rate: Optional[float] = None) -> float:
+    """Секунд між run_at сусідніх отримувачів: duration ділиться на всіх, або 1/rate; 0 — без розподілу."""
+    if duration and total > 1:
+        return duration / total
+    if rate:
+        return 1.0 / rate
+    return 0.0
 
-    messages = [
-        TgOutboxMessage(
-            tg_id=tg_id,
-            event=broadcast.event,
-            trigger=trigger,
-            status=TgOutboxMessage.Status.PENDING,
-            run_at=now,
-            text=broadcast.text,
+
+def enqueue_broadcast(
+    broadcast: TgBroadcast,
+    *,
+    trigger: str = "admin_broadcast",
+    chunk_size: int = ENQUEUE_CHUNK_SIZE,
+    start_at: Optional[datetime] = None,
+    duration: Optional[float] = None,
+    rate: Optional[float] = None,
+) -> int:
+    """
+    Ставить розсилку в outbox шматками: кожен шматок — окремий bulk_create
+    і окрема транзакція разом з просуванням enqueue_cursor і enqueued_count.
+    Курсор просувається умовним UPDATE (compare-and-swap): якщо його вже посунув
+    паралельний запуск, шматок відкочується і цей запуск зупиняється. Тож після збою
+    повторний виклик продовжує з курсора без дублів, навіть якщо перетнувся з іншим.
+
+    start_at / duration / rate (за замовчуванням — send_* з TgBroadcast) розносять run_at:
+    i-й отримувач отримує run_at = start_at + i * інтервал, тож відправка (і навантаження
+    від тих, хто одразу відповідає боту) рівномірно розподіляється в часі.
+    Повертає, скільки повідомлень поставлено в цьому виклику.
+    """
+    now = timezone.now()
+    if broadcast.delivery_mode == TgBroadcast.DeliveryMode.LAZY:
+        # нічого не копіюємо: відправник сам пройде по отримувачах (deliver_lazy_broadcasts);
+        # enqueued_count — лише розмір аудиторії для прогресу / ETA
+        TgBroadcast.objects.filter(pk=broadcast.pk).update(
+            enqueue_status=TgBroadcast.EnqueueStatus.DONE,
+            enqueued_count=broadcast_recipients(broadcast).count(),
+            enqueued_at=now,
+            enqueue_finished_at=now,
+            enqueue_error="",
         )
-        for tg_id in tg_ids
-    ]
+        logger.info("enqueue_broadcast: lazy fan-out armed | broadcast_id=%s", broadcast.id)
+        return 0
 
+    # DONE не перетираємо: запуск, що перетнувся з уже завершеним, зупиниться на першому шматку
+    TgBroadcast.objects.filter(pk=broadcast.pk).exclude(enqueue_status=TgBroadcast.EnqueueStatus.DONE).update(
+        enqueue_status=TgBroadcast.EnqueueStatus.RUNNING,
+        enqueued_at=broadcast.enqueued_at or now,
+        enqueue_error="",
+    )
     logger.info(
-        "enqueue_broadcast: preparing | broadcast_id=%s | segment=%s | recipients=%s",
-        broadcast.id, broadcast.segment, len(messages)
+        "enqueue_broadcast: started | broadcast_id=%s | segment=%s | cursor=%s",
+        broadcast.id, broadcast.segment, broadcast.enqueue_cursor
     )
 
-    with transaction.atomic():
-        # ❗️ВАЖЛИВО:  тільки int, тільки keyword
-        TgOutboxMessage.objects.bulk_create(messages, batch_size=1000)
+    recipients = broadcast_recipients(broadcast)
+    start_at = start_at or broadcast.send_start_at or broadcast.enqueued_at or now
+    duration = duration if duration is not None else broadcast.send_duration_seconds
+    rate = rate if rate is not None else broadcast.send_rate
+    interval = 0.0
+    if duration or rate:
+        # індекс продовжується з enqueued_count, тож після ретраю темп не збивається
+        total = broadcast.enqueued_count + recipients.filter(id__gt=broadcast.enqueue_cursor).count()
+        interval = send_interval(total, duration=duration, rate=rate)
+    position = broadcast.enqueued_count
+
+    enqueued = 0
+    cursor = broadcast.enqueue_cursor
+    chunks = iter_recipient_chunks(recipients, after_id=cursor, chunk_size=chunk_size)
+    for chunk in chunks:
+        # стан перевіряємо на кожному шматку: скасування зупиняє enqueue, пауза ставить рядки одразу в paused
+        state = TgBroadcast.objects.values_list("state", flat=True).get(pk=broadcast.pk)
+        if state == TgBroadcast.State.CANCELLED:
+            logger.info("enqueue_broadcast: cancelled | broadcast_id=%s | enqueued=%s", broadcast.id, enqueued)
+            break
+        status = TgOutboxMessage.Status.PAUSED if state == TgBroadcast.State.PAUSED else TgOutboxMessage.Status.PENDING
 
-        broadcast.enqueued_count = len(messages)
-        broadcast.enqueued_at = now
-        broadcast.save(update_fields=["enqueued_count", "enqueued_at"])
+        messages = [
+            TgOutboxMessage(
+                tg_id=tg_id,
+                event=broadcast.event,
+                broadcast=broadcast,
+                trigger=trigger,
+                status=status,
+                priority=TgOutboxMessage.Priority.BROADCAST,
+                run_at=start_at + timedelta(seconds=(position + i) * interval),
+                text=broadcast.text,
+            )
+            for i, (_, tg_id) in enumerate(chunk)
+        ]
+        position += len(messages)
+
+        with transaction.atomic():
+            TgOutboxMessage.objects.bulk_create(messages, batch_size=chunk_size)
+            moved = TgBroadcast.objects.filter(pk=broadcast.pk, enqueue_cursor=cursor).update(
+                enqueue_cursor=chunk[-1][0],
+                enqueued_count=F("enqueued_count") + len(messages),
+            )
+            if moved:
+                notify_outbox_scheduled([messages[0].run_at])
+            else:
+                # курсор посунув інший запуск enqueue — ці отримувачі вже його, свої рядки відкочуємо
+                transaction.set_rollback(True)
+
+        if not moved:
+            logger.warning(
+                "enqueue_broadcast: cursor moved by another run, stopping | broadcast_id=%s | cursor=%s | enqueued=%s",
+                broadcast.id, cursor, enqueued
+            )
+            broadcast.refresh_from_db()
+            return enqueued
+
+        cursor = chunk[-1][0]
+        enqueued += len(messages)
+        logger.info("enqueue_broadcast: chunk | broadcast_id=%s | enqueued=%s", broadcast.id, enqueued)
+
+    TgBroadcast.objects.filter(pk=broadcast.pk).update(
+        enqueue_status=TgBroadcast.EnqueueStatus.DONE,
+        enqueue_finished_at=timezone.now(),
+    )
+    broadcast.refresh_from_db()
 
     logger.info(
-        "enqueue_broadcast: done | broadcast_id=%s | enqueued=%s",
-        broadcast.id, len(messages)
+        "enqueue_broadcast: done | broadcast_id=%s | enqueued=%s | total=%s",
+        broadcast.id, enqueued, broadcast.enqueued_count
     )
+    return enqueued
+
+
+def pause_broadcast(broadcast: TgBroadcast) -> int:
+    """
+    Зупиняє розсилку: ще не відправлені рядки переходять у paused.
+    Батч, який уже шле воркер, перевіряє стан і теж їх не відправить.
+    """
+    with transaction.atomic():
+        TgBroadcast.objects.filter(pk=broadcast.pk).update(state=TgBroadcast.State.PAUSED)
+        paused = TgOutboxMessage.objects.filter(
+            broadcast=broadcast, status=TgOutboxMessage.Status.PENDING
+        ).update(status=TgOutboxMessage.Status.PAUSED)
+    logger.info("broadcast paused | broadcast_id=%s | messages=%s", broadcast.id, paused)
+    return paused
+
 
-    return len(messages)
+def resume_broadcast(broadcast: TgBroadcast) -> int:
+    now = timezone.now()
+    with transaction.atomic():
+        TgBroadcast.objects.filter(pk=broadcast.pk).exclude(
+            state=TgBroadcast.State.CANCELLED
+        ).update(state=TgBroadcast.State.ACTIVE)
+        resumed = TgOutboxMessage.objects.filter(
+            broadcast=broadcast, status=TgOutboxMessage.Status.PAUSED
+        ).update(status=TgOutboxMessage.Status.PENDING)
+        if resumed:
+            notify_outbox_scheduled([now])
+    logger.info("broadcast resumed | broadcast_id=%s | messages=%s", broadcast.id, resumed)
+    return resumed
+
+
+def cancel_broadcast(broadcast: TgBroadcast) -> int:
+    with transaction.atomic():
+        TgBroadcast.objects.filter(pk=broadcast.pk).update(state=TgBroadcast.State.CANCELLED)
+        cancelled = TgOutboxMessage.objects.filter(
+            broadcast=broadcast,
+            status__in=[TgOutboxMessage.Status.PENDING, TgOutboxMessage.Status.PAUSED],
+        ).update(status=TgOutboxMessage.Status.CANCELLED, lease_expires_at=None)
+    logger.info("broadcast cancelled | broadcast_id=%s | messages=%s", broadcast.id, cancelled)
+    return cancelled
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import logging
+import time
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from core.models import TgBroadcast, TgBroadcastFailure, TgOutboxMessage, TgUser
+from core.services.broadcast import broadcast_recipients
+from core.services.broadcast_progress import record_broadcast_progress
+from core.services.outbox import OutboxSender, SendResult, retry_delay_seconds
+from core.services.outbox_scheduler import notify_outbox_scheduled
+
+logger = logging.getLogger(__name__)
+
+LAZY_CHUNK_SIZE = 200
+
+
+def active_lazy_broadcasts():
+    return TgBroadcast.objects.filter(
+        Q(send_start_at__isnull=True) | Q(send_start_at__lte=timezone.now()),
+        delivery_mode=TgBroadcast.DeliveryMode.LAZY,
+        state=TgBroadcast.State.ACTIVE,
+        enqueue_status=TgBroadcast.EnqueueStatus.DONE,
+        delivery_finished_at__isnull=True,
+    ).order_by("id")
+
+
+def claim_recipients(broadcast: TgBroadcast, limit: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Бере наступні `limit` отримувачів після delivery_cursor і просуває курсор
+    умовним UPDATE (compare-and-swap): якщо курсор уже посунув інший воркер,
+    перечитуємо і пробуємо знову. Повертає [(TgUser.id, tg_id)]; [] — отримувачі скінчились;
+    None — розсилку поставили на паузу / скасували.
+    """
+    while True:
+        cursor, state = TgBroadcast.objects.values_list("delivery_cursor", "state").get(pk=broadcast.pk)
+        if state != TgBroadcast.State.ACTIVE:
+            return None
+        chunk = list(
+            broadcast_recipients(broadcast)
+            .filter(id__gt=cursor)
+            .order_by("id")
+            .values_list("id", "tg_id")[:limit]
+        )
+        if not chunk:
+            return []
+        moved = TgBroadcast.objects.filter(pk=broadcast.pk, delivery_cursor=cursor).update(
+            delivery_cursor=chunk[-1][0]
+        )
+        if moved:
+            return chunk
+
+
+def record_lazy_results(broadcast: TgBroadcast, chunk: List[Tuple[int, int]], results: List[SendResult], trigger: str) -> Dict[str, int]:
+    """
+    Успіхи — тільки лічильник. Тимчасові помилки стають outbox-рядками розсилки
+    (далі ними займається retry/backoff outbox, а пауза / скасування і лічильники
+    розсилки діють і на них), остаточні — рядком TgBroadcastFailure.
+    """
+    tg_by_user = dict(chunk)
+    now = timezone.now()
+    sent = 0
+    failures: List[TgBroadcastFailure] = []
+    retries: List[TgOutboxMessage] = []
+    blocked_tg_ids = set()
+
+    for r in results:
+        tg_id = tg_by_user[r.message_id]
+        if r.ok:
+            sent += 1
+        elif r.retryable:
+            delay = r.defer_seconds or retry_delay_seconds(1)
+            retries.append(TgOutboxMessage(
+                tg_id=tg_id,
+                event=broadcast.event,
+                broadcast=broadcast,
+                trigger=trigger,
+                text=broadcast.text,
+                status=TgOutboxMessage.Status.PENDING,
+                priority=TgOutboxMessage.Priority.BROADCAST,
+                run_at=now + timedelta(seconds=delay),
+                attempts=0 if r.defer_seconds else 1,
+                error=r.error,
+            ))
+        else:
+            failures.append(TgBroadcastFailure(broadcast=broadcast, tg_id=tg_id, error=r.error))
+            if r.unreachable:
+                blocked_tg_ids.add(tg_id)
+
+    with transaction.atomic():
+        TgBroadcast.objects.filter(pk=broadcast.pk).update(
+            sent_count=F("sent_count") + sent,
+            failed_count=F("failed_count") + len(failures),
+        )
+        if failures:
+            TgBroadcastFailure.objects.bulk_create(failures, ignore_conflicts=True)
+        if retries:
+            TgOutboxMessage.objects.bulk_create(retries)
+            notify_outbox_scheduled([m.run_at for m in retries])
+        if blocked_tg_ids:
+            TgUser.objects.filter(tg_id__in=blocked_tg_ids, bot_blocked_at__isnull=True).update(bot_blocked_at=now)
+
+    record_broadcast_progress({broadcast.id: (sent, len(failures))})
+    return {"sent": sent, "failed": len(failures), "retry": len(retries)}
+
+
+def deliver_lazy_broadcasts(
+    *,
+    chunk_size: int = LAZY_CHUNK_SIZE,
+    max_seconds: Optional[float] = None,
+    trigger: str = "admin_broadcast",
+) -> Dict[str, Any]:
+    """
+    Шле активні lazy-розсилки шматками отримувачів, поки вони не скінчаться
+    або не вийде max_seconds. Ліміти Telegram ті самі, що в outbox (спільний лімітер): розсилка
+    бере і відро OUTBOX_RATE_BROADCAST, тож транзакційним повідомленням завжди лишається запас.
+
+    Шматок вважається взятим, щойно курсор посунуто: якщо воркер впаде посеред
+    шматка, ці отримувачі не отримають розсилку (at-most-once, як і було б без outbox).
+    """
+    stop_at = time.monotonic() + max_seconds if max_seconds else None
+    totals = {"sent": 0, "failed": 0, "retry": 0, "broadcasts": 0}
+
+    with OutboxSender() as sender:
+        for broadcast in active_lazy_broadcasts():
+            if stop_at is not None and time.monotonic() >= stop_at:
+                break
+            totals["broadcasts"] += 1
+            while stop_at is None or time.monotonic() < stop_at:
+                chunk = claim_recipients(broadcast, chunk_size)
+                if chunk is None:
+                    logger.info("lazy broadcast halted | broadcast_id=%s", broadcast.id)
+                    break
+                if not chunk:
+                    TgBroadcast.objects.filter(pk=broadcast.pk, delivery_finished_at__isnull=True).update(
+                        delivery_finished_at=timezone.now()
+                    )
+                    logger.info("lazy broadcast finished | broadcast_id=%s", broadcast.id)
+                    break
+                # priority=BROADCAST: ті самі ліміти, що й broadcast-смуга outbox (OUTBOX_RATE_BROADCAST)
+                units = [
+                    TgOutboxMessage(id=user_id, tg_id=tg_id, text=broadcast.text, priority=TgOutboxMessage.Priority.BROADCAST)
+                    for user_id, tg_id in chunk
+                ]
+                deadline = stop_at or time.monotonic() + settings.OUTBOX_LEASE_SECONDS * 0.8
+                results = sender.send(units, deadline=deadline)
+                for k, v in record_lazy_results(broadcast, chunk, results, trigger).items():
+                    totals[k] += v
+
+    logger.info(
+        "lazy broadcasts tick | broadcasts=%s sent=%s failed=%s retry=%s",
+        totals["broadcasts"], totals["sent"], totals["failed"], totals["retry"],
+    )
+    return totals
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import logging
+import time
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+import redis
+
+from core.models import TgBroadcast
+from core.services.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# hash з лічильниками sent / failed
+PROGRESS_KEY = "broadcast:{}:progress"
+# лічильник відправлених за RATE_BUCKET_SECONDS-секундний інтервал, для поточної швидкості
+RATE_KEY = "broadcast:{}:rate:{}"
+RATE_BUCKET_SECONDS = 10
+RATE_WINDOW_BUCKETS = 6
+PROGRESS_TTL = 7 * 24 * 3600
+
+
+def record_broadcast_progress(counts: Mapping[int, Tuple[int, int]]) -> None:
+    """counts: broadcast_id -> (sent, failed) за батч. Один pipeline на батч; без Redis — нічого."""
+    counts = {bid: c for bid, c in counts.items() if c[0] or c[1]}
+    r = get_redis()
+    if r is None or not counts:
+        return
+    bucket = int(time.time()) // RATE_BUCKET_SECONDS
+    try:
+        pipe = r.pipeline(transaction=False)
+        for bid, (sent, failed) in counts.items():
+            key = PROGRESS_KEY.format(bid)
+            if sent:
+                pipe.hincrby(key, "sent", sent)
+                rate_key = RATE_KEY.format(bid, bucket)
+                pipe.incrby(rate_key, sent)
+                pipe.expire(rate_key, RATE_BUCKET_SECONDS * (RATE_WINDOW_BUCKETS + 1))
+            if failed:
+                pipe.hincrby(key, "failed", failed)
+            pipe.expire(key, PROGRESS_TTL)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning("broadcast progress: cannot record | %s", e)
+
+
+def _current_rate(r: redis.Redis, broadcast_id: int) -> float:
+    # останній (поточний, неповний) інтервал не рахуємо, щоб швидкість не «провалювалась»
+    bucket = int(time.time()) // RATE_BUCKET_SECONDS
+    keys = [RATE_KEY.format(broadcast_id, bucket - i) for i in range(1, RATE_WINDOW_BUCKETS + 1)]
+    sent = sum(int(v) for v in r.mget(keys) if v)
+    return sent / (RATE_BUCKET_SECONDS * RATE_WINDOW_BUCKETS)
+
+
+def get_broadcast_progress(broadcast: TgBroadcast) -> Dict[str, Any]:
+    """
+    sent / failed / remaining, поточна швидкість (msg/s за останню хвилину) і ETA в секундах.
+    Без Redis — лічильники з TgBroadcast, без швидкості.
+    """
+    sent, failed = broadcast.sent_count, broadcast.failed_count
+    rate = 0.0
+    r = get_redis()
+    if r is not None:
+        try:
+            live = r.hgetall(PROGRESS_KEY.format(broadcast.id))
+            sent = max(sent, int(live.get(b"sent", 0)))
+            failed = max(failed, int(live.get(b"failed", 0)))
+            rate = _current_rate(r, broadcast.id)
+        except redis.RedisError as e:
+            logger.warning("broadcast progress: cannot read | broadcast_id=%s | %s", broadcast.id, e)
+
+    remaining = max(0, broadcast.enqueued_count - sent - failed)
+    if broadcast.state == TgBroadcast.State.CANCELLED:
+        remaining = 0
+    eta: Optional[float] = round(remaining / rate) if rate > 0 and remaining else None
+    return {
+        "sent": sent,
+        "failed": failed,
+        "remaining": remaining,
+        "rate_per_s": round(rate, 2),
+        "eta_s": eta,
+    }
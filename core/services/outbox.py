@@ -0,0 +1,672 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from dataclasses import dataclass, replace
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+import redis
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from core.models import TgBroadcast, TgOutboxMessage, TgUser
+from core.services.broadcast_progress import record_broadcast_progress
+from core.services.rate_limit import TelegramRateLimiter, get_telegram_rate_limiter
+from core.services.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_SEND_MESSAGE_URL = "https://api.telegram.org/bot{token}/sendMessage"
+TELEGRAM_MAX_TEXT_LENGTH = 4096
+COALESCE_SEPARATOR = "\n\n"
+
+
+class TelegramSendError(RuntimeError):
+    def __init__(
+        self,
+        description: str,
+        *,
+        status_code: Optional[int] = None,
+        retry_after: Optional[int] = None,
+    ) -> None:
+        super().__init__(description)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+@dataclass
+class SendResult:
+    message_id: int
+    ok: bool
+    error: str = ""
+    latency: float = 0.0
+    retryable: bool = False
+    # 429 не встигли дочекатись у цьому батчі — перенести на стільки секунд без +attempt
+    defer_seconds: Optional[float] = None
+    # чат недосяжний (бот заблокований / юзер видалений) — позначити TgUser.bot_blocked_at
+    unreachable: bool = False
+    # не слали взагалі: юзер уже в списку заблокованих
+    suppressed: bool = False
+
+
+SUPPRESSED_ERROR = "suppressed: bot blocked by user"
+
+
+def is_retryable_error(e: Exception) -> bool:
+    """
+    Тимчасові помилки (мережа, таймаути, 429, 5xx) — варто повторити пізніше.
+    Решта (400 / 403 / невідомі) — повтор нічого не змінить.
+    """
+    if isinstance(e, httpx.TransportError):
+        return True
+    if isinstance(e, TelegramSendError):
+        return e.status_code == 429 or (e.status_code or 0) >= 500
+    return False
+
+
+def is_unreachable_chat(e: Exception) -> bool:
+    """403 (бот заблокований, юзер деактивований) або 400 «chat not found» — слати цьому чату марно."""
+    if not isinstance(e, TelegramSendError):
+        return False
+    if e.status_code == 403:
+        return True
+    return e.status_code == 400 and "chat not found" in str(e).lower()
+
+
+async def send_telegram_message_async(client: httpx.AsyncClient, token: str, chat_id: int, text: str) -> None:
+    r = await client.post(
+        TELEGRAM_SEND_MESSAGE_URL.format(token=token),
+        json={"chat_id": chat_id, "text": text},
+    )
+    try:
+        data = r.json()
+    except ValueError:
+        data = {}
+
+    if r.status_code >= 400 or not data.get("ok"):
+        description = data.get("description") or r.text[:500] or f"HTTP {r.status_code}"
+        retry_after = (data.get("parameters") or {}).get("retry_after")
+        if retry_after is None and r.status_code == 429:
+            retry_after = r.headers.get("Retry-After")
+        raise TelegramSendError(
+            f"{r.status_code}: {description}",
+            status_code=r.status_code,
+            retry_after=int(retry_after) if retry_after else None,
+        )
+
+
+class OutboxSender:
+    """
+    Відправляє пачки повідомлень через один keep-alive httpx-клієнт
+    з обмеженою кількістю паралельних запитів і в межах лімітів Telegram.
+
+    Використання:
+        with OutboxSender() as sender:
+            results = sender.send(msgs)
+    """
+
+    # скільки разів одне повідомлення може отримати 429 в межах батчу, перш ніж його відкладемо
+    MAX_THROTTLED_RETRIES = 3
+
+    def __init__(
+        self,
+        *,
+        token: Optional[str] = None,
+        concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+        limiter: Optional[TelegramRateLimiter] = None,
+    ) -> None:
+        self.token = token or settings.TELEGRAM_BOT_TOKEN
+        self.concurrency = max(1, concurrency or settings.OUTBOX_CONCURRENCY)
+        self.timeout = timeout or settings.OUTBOX_HTTP_TIMEOUT
+        self.limiter = limiter or get_telegram_rate_limiter()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def __enter__(self) -> "OutboxSender":
+        self._loop = asyncio.new_event_loop()
+        self._client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=self.concurrency,
+                max_keepalive_connections=self.concurrency,
+            ),
+        )
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        try:
+            self._loop.run_until_complete(self._client.aclose())
+        finally:
+            self._loop.close()
+            self._loop = None
+            self._client = None
+
+    def send(self, messages: Sequence[TgOutboxMessage], *, deadline: Optional[float] = None) -> List[SendResult]:
+        """
+        deadline (time.monotonic()) — до коли батч має закінчитись (напр., поки живий lease).
+        Після 429 повідомлення чекає retry_after і шлеться ще раз у цьому ж батчі,
+        якщо встигає до deadline (і не більше MAX_THROTTLED_RETRIES разів);
+        інакше повертається з defer_seconds.
+        """
+        if not messages:
+            return []
+        return self._loop.run_until_complete(self._send_all(messages, deadline))
+
+    async def _send_all(self, messages: Sequence[TgOutboxMessage], deadline: Optional[float]) -> List[SendResult]:
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def _one(m: TgOutboxMessage) -> SendResult:
+            async with sem:
+                throttled = 0
+                while True:
+                    await self.limiter.acquire(m.tg_id, broadcast=m.priority == TgOutboxMessage.Priority.BROADCAST)
+                    started = time.perf_counter()
+                    try:
+                        await send_telegram_message_async(self._client, self.token, m.tg_id, m.text)
+                    except TelegramSendError as e:
+                        latency = time.perf_counter() - started
+                        if e.status_code == 429 and e.retry_after:
+                            # пауза спільна для всіх воркерів — далі всі чекають на acquire()
+                            await asyncio.to_thread(self.limiter.pause, e.retry_after)
+                            logger.warning("Telegram 429 | pause %ss | outbox_id=%s", e.retry_after, m.id)
+                            throttled += 1
+                            in_time = deadline is None or time.monotonic() + e.retry_after < deadline
+                            if in_time and throttled <= self.MAX_THROTTLED_RETRIES:
+                                continue
+                            return SendResult(m.id, False, error=str(e), latency=latency,
+                                              retryable=True, defer_seconds=e.retry_after)
+                        return SendResult(m.id, False, error=str(e), latency=latency,
+                                          retryable=is_retryable_error(e),
+                                          unreachable=is_unreachable_chat(e))
+                    except Exception as e:
+                        return SendResult(m.id, False, error=str(e) or type(e).__name__,
+                                          latency=time.perf_counter() - started,
+                                          retryable=is_retryable_error(e))
+                    return SendResult(m.id, True, latency=time.perf_counter() - started)
+
+        return list(await asyncio.gather(*(_one(m) for m in messages)))
+
+
+def _percentile(values: Sequence[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def summarize_results(results: Sequence[SendResult], elapsed: float) -> Dict[str, Any]:
+    latencies = [r.latency for r in results]
+    sent = sum(1 for r in results if r.ok)
+    return {
+        "total": len(results),
+        "sent": sent,
+        "failed": len(results) - sent,
+        "elapsed_s": round(elapsed, 3),
+        "rate_per_s": round(len(results) / elapsed, 2) if elapsed > 0 else 0.0,
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000, 1),
+    }
+
+
+def new_claim_token() -> str:
+    host = socket.gethostname()[:40]
+    return f"{host}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def claimable_q(now) -> Q:
+    """Рядки, які можна взяти в роботу: pending, настав run_at, lease вільний або протух."""
+    return (
+        Q(status=TgOutboxMessage.Status.PENDING, run_at__lte=now)
+        & (Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lte=now))
+    )
+
+
+def claim_candidates(claimable: Q):
+    # має йти по outbox_pending_prio_run_at_idx (див. core/tests.py)
+    return TgOutboxMessage.objects.filter(claimable).order_by("run_at")
+
+
+def _claim_ids(claimable: Q, limit: int, token: str, lease_until) -> Tuple[List[int], int]:
+    """
+    Claim до `limit` рядків під умовою `claimable`.
+    Повертає (id-кандидати, скільки з них реально взяли).
+    """
+    if limit <= 0:
+        return [], 0
+    candidates = claim_candidates(claimable)
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(candidates.select_for_update(skip_locked=True).values_list("id", flat=True)[:limit])
+            if not ids:
+                return [], 0
+            return ids, TgOutboxMessage.objects.filter(id__in=ids).update(
+                claimed_by=token, lease_expires_at=lease_until
+            )
+
+    ids = list(candidates.values_list("id", flat=True)[:limit])
+    if not ids:
+        return [], 0
+    return ids, TgOutboxMessage.objects.filter(claimable, id__in=ids).update(
+        claimed_by=token, lease_expires_at=lease_until
+    )
+
+
+def lane_quotas(limit: int) -> Dict[int, int]:
+    """Ділить батч між пріоритетами пропорційно OUTBOX_LANE_WEIGHTS (мінімум 1 на смугу)."""
+    weights = settings.OUTBOX_LANE_WEIGHTS
+    total = sum(weights.values())
+    return {lane: max(1, limit * w // total) for lane, w in weights.items()}
+
+
+def claim_outbox_batch(
+    limit: int,
+    *,
+    token: Optional[str] = None,
+    lease_seconds: Optional[int] = None,
+) -> Tuple[str, List[TgOutboxMessage]]:
+    """
+    Забирає в роботу до `limit` повідомлень, яким настав run_at і які
+    ніхто не тримає (або чий lease вже протух). Повертає (token, msgs).
+
+    Батч ділиться між пріоритетами (transactional > triggered > broadcast)
+    за вагами OUTBOX_LANE_WEIGHTS; якщо якась смуга порожня, її місце
+    дістається іншим у порядку пріоритету. Тож велика розсилка не блокує
+    повідомлення після оплати, а й сама не голодує.
+
+    Postgres/MySQL 8: SELECT ... FOR UPDATE SKIP LOCKED, паралельні воркери
+    просто отримують різні рядки.
+    SQLite: умовний UPDATE по тих самих умовах — рядок дістанеться тому,
+    чий UPDATE пройшов першим, решта його не побачать.
+    """
+    token = token or new_claim_token()
+    now = timezone.now()
+    lease_until = now + timedelta(seconds=lease_seconds or settings.OUTBOX_LEASE_SECONDS)
+
+    claimable = claimable_q(now)
+
+    ids: List[int] = []
+    claimed = 0
+
+    def _claim_lane(lane: int, n: int) -> None:
+        nonlocal claimed
+        lane_ids, lane_claimed = _claim_ids(claimable & Q(priority=lane), n, token, lease_until)
+        ids.extend(lane_ids)
+        claimed += lane_claimed
+
+    for lane, quota in sorted(lane_quotas(limit).items()):
+        _claim_lane(lane, min(quota, limit - claimed))
+    # недобір (порожні смуги) добираємо в порядку пріоритету
+    for lane in sorted(settings.OUTBOX_LANE_WEIGHTS):
+        if claimed >= limit:
+            break
+        _claim_lane(lane, limit - claimed)
+
+    if not claimed:
+        return token, []
+
+    msgs = list(
+        TgOutboxMessage.objects
+        .filter(id__in=ids, claimed_by=token)
+        .order_by("priority", "run_at")
+    )
+    return token, msgs
+
+
+def retry_delay_seconds(attempts: int) -> float:
+    """Експоненційний backoff з jitter: base * 2^(attempts-1), обрізаний до max, ×[0.5, 1)."""
+    delay = min(
+        settings.OUTBOX_RETRY_MAX_SECONDS,
+        settings.OUTBOX_RETRY_BASE_SECONDS * (2 ** max(0, attempts - 1)),
+    )
+    return delay * random.uniform(0.5, 1.0)
+
+
+OUTCOMES = ("sent", "failed", "retry", "dead", "deferred", "suppressed", "halted")
+
+
+def write_back_results(token: str, msgs: Sequence[TgOutboxMessage], results: Sequence[SendResult]) -> Dict[str, int]:
+    """
+    Записує результати батчу згрупованими UPDATE в одній транзакції
+    (замість UPDATE на кожне повідомлення) і повертає кількість по кожному результату.
+    Пишемо тільки рядки, чий lease досі наш — інші вже в іншого воркера.
+    """
+    by_id = {m.id: m for m in msgs}
+    now = timezone.now()
+    outcomes = dict.fromkeys(OUTCOMES, 0)
+
+    sent_ids: List[int] = []
+    blocked_tg_ids = set()
+    # (outbox id, broadcast_id, ok) — остаточні результати рядків розсилок; рахуються тільки наші рядки
+    broadcast_results: List[Tuple[int, int, bool]] = []
+    terminal: Dict[Tuple[str, str], List[int]] = {}  # (status, error) -> ids
+    rescheduled: List[TgOutboxMessage] = []
+
+    for r in results:
+        m = by_id[r.message_id]
+        attempts = m.attempts + 1
+        if m.broadcast_id and (r.ok or not r.retryable or attempts >= settings.OUTBOX_MAX_ATTEMPTS) and not r.defer_seconds:
+            broadcast_results.append((m.id, m.broadcast_id, r.ok))
+
+        if r.defer_seconds:
+            # Telegram попросив почекати — це не спроба, просто переносимо
+            m.run_at = now + timedelta(seconds=r.defer_seconds)
+            m.error = r.error
+            rescheduled.append(m)
+            outcomes["deferred"] += 1
+        elif r.ok:
+            sent_ids.append(m.id)
+            outcomes["sent"] += 1
+        elif r.suppressed:
+            terminal.setdefault((TgOutboxMessage.Status.FAILED, r.error), []).append(m.id)
+            outcomes["suppressed"] += 1
+        elif not r.retryable:
+            terminal.setdefault((TgOutboxMessage.Status.FAILED, r.error), []).append(m.id)
+            outcomes["failed"] += 1
+            if r.unreachable:
+                blocked_tg_ids.add(m.tg_id)
+            logger.warning("Cannot send | outbox_id=%s | %s", m.id, r.error)
+        elif attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+            terminal.setdefault((TgOutboxMessage.Status.DEAD, r.error), []).append(m.id)
+            outcomes["dead"] += 1
+            logger.warning("Giving up | outbox_id=%s | attempts=%s | %s", m.id, attempts, r.error)
+        else:
+            delay = retry_delay_seconds(attempts)
+            m.run_at = now + timedelta(seconds=delay)
+            m.error = r.error
+            m.attempts = attempts
+            rescheduled.append(m)
+            outcomes["retry"] += 1
+            logger.info("Will retry | outbox_id=%s | attempt=%s | in=%.0fs | %s", m.id, attempts, delay, r.error)
+
+    per_broadcast: Dict[int, List[int]] = {}
+    with transaction.atomic():
+        mine = TgOutboxMessage.objects.filter(claimed_by=token)
+        # рядки, чий lease протух і які вже забрав інший воркер, не пишемо і не рахуємо
+        owned = set(mine.select_for_update().filter(id__in=list(by_id)).values_list("id", flat=True))
+
+        # broadcast_id -> [sent, failed] для лічильників розсилок
+        for msg_id, broadcast_id, ok in broadcast_results:
+            if msg_id in owned:
+                per_broadcast.setdefault(broadcast_id, [0, 0])[0 if ok else 1] += 1
+
+        if sent_ids:
+            mine.filter(id__in=sent_ids).update(
+                status=TgOutboxMessage.Status.SENT,
+                sent_at=now,
+                error="",
+                attempts=F("attempts") + 1,
+                lease_expires_at=None,
+            )
+
+        for (status, error), ids in terminal.items():
+            mine.filter(id__in=ids).update(
+                status=status,
+                error=error,
+                attempts=F("attempts") + 1,
+                lease_expires_at=None,
+            )
+
+        if rescheduled:
+            objs = [m for m in rescheduled if m.id in owned]
+            for m in objs:
+                m.lease_expires_at = None
+            TgOutboxMessage.objects.bulk_update(
+                objs, ["run_at", "error", "attempts", "lease_expires_at"], batch_size=500
+            )
+
+        if blocked_tg_ids:
+            TgUser.objects.filter(tg_id__in=blocked_tg_ids, bot_blocked_at__isnull=True).update(bot_blocked_at=now)
+
+        for broadcast_id, (sent, failed) in per_broadcast.items():
+            TgBroadcast.objects.filter(pk=broadcast_id).update(
+                sent_count=F("sent_count") + sent,
+                failed_count=F("failed_count") + failed,
+            )
+
+    record_broadcast_progress(per_broadcast)
+    if blocked_tg_ids:
+        logger.info("outbox: marked users as bot-blocked | count=%s", len(blocked_tg_ids))
+
+    return outcomes
+
+
+DRAIN_SLOT_KEY = "outbox:drainer:{}"
+
+# звільняє слот, тільки якщо він досі наш (а не вже протух і зайнятий іншим)
+_RELEASE_SLOT_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def coalesce_messages(
+    msgs: Sequence[TgOutboxMessage],
+    window: float,
+) -> List[Tuple[TgOutboxMessage, List[int]]]:
+    """
+    Склеює повідомлення в один чат, чиї run_at лежать у межах `window` секунд
+    від першого в групі, якщо сумарний текст вміщається в ліміт Telegram.
+    Повертає [(одиниця відправки, id усіх повідомлень, які вона покриває)].
+    Одиниця — незбережений TgOutboxMessage з id першого повідомлення групи.
+    """
+    if window <= 0:
+        return [(m, [m.id]) for m in msgs]
+
+    by_chat: Dict[int, List[TgOutboxMessage]] = {}
+    for m in msgs:
+        by_chat.setdefault(m.tg_id, []).append(m)
+
+    units: List[Tuple[TgOutboxMessage, List[int]]] = []
+    for chat_msgs in by_chat.values():
+        chat_msgs.sort(key=lambda m: (m.run_at, m.id))
+        group: List[TgOutboxMessage] = []
+        length = 0
+        for m in chat_msgs:
+            fits = length + len(COALESCE_SEPARATOR) + len(m.text) <= TELEGRAM_MAX_TEXT_LENGTH
+            in_window = group and (m.run_at - group[0].run_at).total_seconds() <= window
+            if group and not (fits and in_window):
+                units.append(_merge_group(group))
+                group, length = [], 0
+            length += (len(COALESCE_SEPARATOR) if group else 0) + len(m.text)
+            group.append(m)
+        if group:
+            units.append(_merge_group(group))
+    return units
+
+
+def _merge_group(group: List[TgOutboxMessage]) -> Tuple[TgOutboxMessage, List[int]]:
+    if len(group) == 1:
+        return group[0], [group[0].id]
+    first = group[0]
+    unit = TgOutboxMessage(
+        id=first.id,
+        tg_id=first.tg_id,
+        text=COALESCE_SEPARATOR.join(m.text for m in group),
+        priority=min(m.priority for m in group),
+    )
+    return unit, [m.id for m in group]
+
+
+def _release_halted(token: str, msgs: List[TgOutboxMessage]) -> Tuple[List[TgOutboxMessage], int]:
+    """
+    Один запит на батч: чи не поставили розсилки з цього батчу на паузу / не скасували.
+    Такі повідомлення не шлемо, а переводимо в paused / cancelled (resume поверне їх у pending).
+    """
+    broadcast_ids = {m.broadcast_id for m in msgs if m.broadcast_id}
+    if not broadcast_ids:
+        return msgs, 0
+    halted = dict(
+        TgBroadcast.objects
+        .filter(id__in=broadcast_ids)
+        .exclude(state=TgBroadcast.State.ACTIVE)
+        .values_list("id", "state")
+    )
+    if not halted:
+        return msgs, 0
+
+    by_status: Dict[str, List[int]] = {}
+    for m in msgs:
+        if m.broadcast_id in halted:
+            status = (
+                TgOutboxMessage.Status.CANCELLED
+                if halted[m.broadcast_id] == TgBroadcast.State.CANCELLED
+                else TgOutboxMessage.Status.PAUSED
+            )
+            by_status.setdefault(status, []).append(m.id)
+    for status, ids in by_status.items():
+        TgOutboxMessage.objects.filter(claimed_by=token, id__in=ids).update(status=status, lease_expires_at=None)
+
+    count = sum(len(ids) for ids in by_status.values())
+    logger.info("outbox: skipped halted broadcasts | messages=%s | broadcasts=%s", count, sorted(halted))
+    return [m for m in msgs if m.broadcast_id not in halted], count
+
+
+def _send_claimed(sender: OutboxSender, limit: int) -> Tuple[List[SendResult], Dict[str, int]]:
+    token, msgs = claim_outbox_batch(limit)
+    if not msgs:
+        return [], dict.fromkeys(OUTCOMES, 0)
+
+    logger.info("outbox batch started | claimed=%s | worker=%s", len(msgs), token)
+
+    msgs, halted = _release_halted(token, msgs)
+
+    # хто заблокував бота — не витрачаємо на них ні запит, ні токен лімітера
+    blocked = set(
+        TgUser.objects
+        .filter(tg_id__in={m.tg_id for m in msgs}, bot_blocked_at__isnull=False)
+        .values_list("tg_id", flat=True)
+    )
+    suppressed = [SendResult(m.id, False, error=SUPPRESSED_ERROR, suppressed=True) for m in msgs if m.tg_id in blocked]
+    to_send = [m for m in msgs if m.tg_id not in blocked]
+
+    units = coalesce_messages(to_send, settings.OUTBOX_COALESCE_WINDOW)
+    if len(units) < len(to_send):
+        logger.info("outbox coalesced | messages=%s | sends=%s", len(to_send), len(units))
+    covers = {unit.id: ids for unit, ids in units}
+
+    # запас, щоб встигнути записати результати, поки lease ще наш
+    deadline = time.monotonic() + settings.OUTBOX_LEASE_SECONDS * 0.8
+    results = sender.send([unit for unit, _ in units], deadline=deadline)
+    # результат склеєної відправки стосується кожного повідомлення, яке в неї увійшло
+    expanded = [replace(r, message_id=mid) for r in results for mid in covers[r.message_id]]
+    outcomes = write_back_results(token, msgs, expanded + suppressed)
+    outcomes["halted"] = halted
+    return results, outcomes
+
+
+def _log_stats(prefix: str, stats: Dict[str, Any]) -> None:
+    logger.info(
+        "%s | sent=%s failed=%s retry=%s dead=%s deferred=%s suppressed=%s halted=%s rate=%s/s p50=%sms p95=%sms",
+        prefix, stats["sent"], stats["failed"], stats["retry"], stats["dead"], stats["deferred"], stats["suppressed"],
+        stats["halted"],
+        stats["rate_per_s"], stats["p50_ms"], stats["p95_ms"],
+    )
+
+
+def process_outbox_batch(limit: int = 200) -> Dict[str, Any]:
+    """
+    Забирає (claim) до `limit` pending-повідомлень, у яких настав run_at,
+    відправляє їх паралельно і записує статус кожного.
+    Тимчасові помилки не валять повідомлення, а переносять run_at (backoff).
+    """
+    started = time.perf_counter()
+    with OutboxSender() as sender:
+        results, outcomes = _send_claimed(sender, limit)
+    stats = {**summarize_results(results, time.perf_counter() - started), **outcomes}
+    _log_stats("outbox batch finished", stats)
+    return stats
+
+
+def acquire_slot(key_template: str, slots: int, ttl: int) -> Tuple[Optional[str], str]:
+    """
+    Займає один з `slots` слотів у Redis (SET NX EX по key_template.format(i)). Повертає (key, token);
+    key=None — всі слоти зайняті. Без Redis координації немає: повертає ("", token).
+    """
+    token = new_claim_token()
+    r = get_redis()
+    if r is None:
+        return "", token
+    try:
+        for i in range(slots):
+            key = key_template.format(i)
+            if r.set(key, token, nx=True, ex=ttl):
+                return key, token
+    except redis.RedisError as e:
+        logger.warning("slot lock: redis unavailable, running uncoordinated | %s | %s", key_template, e)
+        return "", token
+    return None, token
+
+
+def release_slot(key: str, token: str) -> None:
+    r = get_redis()
+    if not key or r is None:
+        return
+    try:
+        r.eval(_RELEASE_SLOT_LUA, 1, key, token)
+    except redis.RedisError as e:
+        logger.warning("slot lock: cannot release slot %s | %s", key, e)
+
+
+def _acquire_drain_slot(ttl: int) -> Tuple[Optional[str], str]:
+    # без Redis від подвійної відправки все одно захищають lease
+    return acquire_slot(DRAIN_SLOT_KEY, settings.OUTBOX_MAX_DRAINERS, ttl)
+
+
+def drain_outbox(
+    *,
+    batch_size: int = 200,
+    max_seconds: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Шле батч за батчем через один клієнт, поки черга не спорожніє
+    або не вийде max_seconds (None — без обмеження часу).
+    Одночасно працює не більше OUTBOX_MAX_DRAINERS таких циклів;
+    якщо всі слоти зайняті — одразу повертає skipped=True.
+    """
+    ttl = int((max_seconds or 3600) + settings.OUTBOX_LEASE_SECONDS)
+    slot, token = _acquire_drain_slot(ttl)
+    if slot is None:
+        logger.info("outbox drain skipped: all %s drainer slots busy", settings.OUTBOX_MAX_DRAINERS)
+        return {"skipped": True, "batches": 0, **summarize_results([], 0), **dict.fromkeys(OUTCOMES, 0)}
+
+    started = time.perf_counter()
+    stop_at = time.monotonic() + max_seconds if max_seconds else None
+    all_results: List[SendResult] = []
+    totals = dict.fromkeys(OUTCOMES, 0)
+    batches = 0
+
+    try:
+        with OutboxSender() as sender:
+            while stop_at is None or time.monotonic() < stop_at:
+                results, outcomes = _send_claimed(sender, batch_size)
+                if not any(outcomes.values()):
+                    break
+                batches += 1
+                all_results += results
+                for k, v in outcomes.items():
+                    totals[k] += v
+    finally:
+        release_slot(slot, token)
+
+    stats = {
+        "skipped": False,
+        "batches": batches,
+        **summarize_results(all_results, time.perf_counter() - started),
+        **totals,
+    }
+    _log_stats(f"outbox drain finished | batches={batches}", stats)
+    return stats
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import logging
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import TgOutboxArchive, TgOutboxMessage
+
+logger = logging.getLogger(__name__)
+
+ARCHIVABLE_STATUSES = (
+    TgOutboxMessage.Status.SENT,
+    TgOutboxMessage.Status.FAILED,
+    TgOutboxMessage.Status.DEAD,
+    TgOutboxMessage.Status.CANCELLED,
+)
+
+
+def archive_outbox_messages(
+    *,
+    older_than_days: Optional[int] = None,
+    chunk_size: int = 1000,
+    max_chunks: int = 200,
+) -> Dict[str, Any]:
+    """
+    Переносить sent/failed/dead/cancelled повідомлення з run_at старше N днів у TgOutboxArchive
+    шматками по chunk_size: кожен шматок — окрема коротка транзакція (insert + delete),
+    щоб не тримати довгих локів на живій черзі.
+    """
+    days = older_than_days if older_than_days is not None else settings.OUTBOX_ARCHIVE_AFTER_DAYS
+    cutoff = timezone.now() - timedelta(days=days)
+
+    archived = 0
+    chunks = 0
+    while chunks < max_chunks:
+        with transaction.atomic():
+            rows = list(
+                TgOutboxMessage.objects
+                .filter(status__in=ARCHIVABLE_STATUSES, run_at__lt=cutoff)
+                .order_by("run_at")
+                .values("id", "tg_id", "event_id", "trigger", "status", "attempts",
+                        "error", "run_at", "sent_at", "created_at", "dedup_key")[:chunk_size]
+            )
+            if not rows:
+                break
+
+            TgOutboxArchive.objects.bulk_create(
+                [TgOutboxArchive(**{**row, "error": (row["error"] or "")[:255]}) for row in rows],
+                ignore_conflicts=True,
+            )
+            TgOutboxMessage.objects.filter(id__in=[row["id"] for row in rows]).delete()
+
+        archived += len(rows)
+        chunks += 1
+
+    logger.info(
+        "archive_outbox_messages: done | archived=%s chunks=%s older_than_days=%s",
+        archived, chunks, days,
+    )
+    return {"archived": archived, "chunks": chunks, "more": chunks >= max_chunks}
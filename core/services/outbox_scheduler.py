@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import logging
+import math
+import time
+from datetime import datetime
+from typing import Iterable, Optional
+
+import redis
+from django.db import close_old_connections, transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from core.models import TgOutboxMessage
+from core.services.outbox import drain_outbox
+from core.services.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# sorted set: member/score = unix-час, коли щось у черзі стає due
+DUE_KEY = "outbox:due"
+# список-«дзвіночок»: enqueue штовхає сюди, щоб dispatcher прокинувся одразу
+WAKE_KEY = "outbox:wake"
+
+# як довго максимум спимо між перевірками (і таймаут BLPOP — менший за socket_timeout клієнта)
+MAX_SLEEP_SECONDS = 1.0
+
+
+def _score(dt: datetime) -> float:
+    # округлюємо вгору до 0.1с, щоб не прокидатись раніше, ніж рядок стане due
+    return math.ceil(dt.timestamp() * 10) / 10
+
+
+def _schedule_now(run_ats: Iterable[datetime]) -> None:
+    r = get_redis()
+    if r is None:
+        return
+    scores = {f"{ts:.1f}": ts for ts in {_score(dt) for dt in run_ats}}
+    if not scores:
+        return
+    try:
+        pipe = r.pipeline(transaction=False)
+        pipe.zadd(DUE_KEY, scores)
+        pipe.lpush(WAKE_KEY, 1)
+        pipe.ltrim(WAKE_KEY, 0, 0)
+        pipe.execute()
+    except redis.RedisError as e:
+        # не критично: повідомлення однаково забере beat-тік outbox_tick
+        logger.warning("outbox scheduler: cannot publish run_at | %s", e)
+
+
+def notify_outbox_scheduled(run_ats: Iterable[datetime]) -> None:
+    """
+    Дзеркалить run_at нових повідомлень в Redis-індекс dispatcher'а.
+    Викликати після створення TgOutboxMessage; публікація відбувається
+    після коміту транзакції, щоб dispatcher не прокинувся раніше, ніж рядки видно.
+    """
+    run_ats = list(run_ats)
+    if run_ats:
+        transaction.on_commit(lambda: _schedule_now(run_ats))
+
+
+def _schedule_next_pending(r: redis.Redis, *, not_before: Optional[float] = None) -> None:
+    """
+    Індекс самовідновлюється з БД: коли наступного разу варто прокинутись.
+    Враховує і вже due pending-рядки (drain уперся в max_seconds і лишив backlog) —
+    тоді прокидаємось одразу, — і рядки під чужим lease: їх можна буде забрати, коли lease протухне.
+    not_before (unix-час) — не раніше: коли всі слоти drainer'ів зайняті, не крутимось вхолосту.
+    """
+    now = timezone.now()
+    free = Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lte=now)
+    agg = TgOutboxMessage.objects.filter(status=TgOutboxMessage.Status.PENDING).aggregate(
+        free=Min("run_at", filter=free),
+        leased=Min("lease_expires_at", filter=~free),
+    )
+    nxt = min((dt for dt in (agg["free"], agg["leased"]) if dt), default=None)
+    if nxt:
+        ts = max(_score(nxt), _score(now), not_before or 0)
+        r.zadd(DUE_KEY, {f"{ts:.1f}": ts})
+
+
+def run_outbox_dispatcher(
+    *,
+    batch_size: int = 200,
+    max_drain_seconds: float = 55,
+    stop_after: Optional[float] = None,
+) -> None:
+    """
+    Довгоживучий цикл: спить до найближчого run_at з DUE_KEY (або до сигналу в WAKE_KEY),
+    тоді запускає drain_outbox. Beat-тік лишається страховкою, якщо dispatcher не працює.
+    """
+    r = get_redis()
+    if r is None:
+        raise RuntimeError("REDIS_URL not set: outbox dispatcher needs Redis")
+
+    started = time.monotonic()
+    # все, що вже due, і найближче майбутнє
+    r.zadd(DUE_KEY, {"0": 0})
+    _schedule_next_pending(r)
+    logger.info("outbox dispatcher started")
+
+    while stop_after is None or time.monotonic() - started < stop_after:
+        try:
+            now = time.time()
+            head = r.zrange(DUE_KEY, 0, 0, withscores=True)
+            if head and head[0][1] <= now:
+                r.zremrangebyscore(DUE_KEY, "-inf", now)
+                close_old_connections()
+                stats = drain_outbox(batch_size=batch_size, max_seconds=max_drain_seconds)
+                # skipped — зараз дренують інші; перевіримо знову за MAX_SLEEP_SECONDS
+                _schedule_next_pending(r, not_before=time.time() + MAX_SLEEP_SECONDS if stats["skipped"] else None)
+                continue
+
+            sleep_for = MAX_SLEEP_SECONDS if not head else min(MAX_SLEEP_SECONDS, head[0][1] - now)
+            r.blpop([WAKE_KEY], timeout=max(0.01, sleep_for))
+        except redis.RedisError as e:
+            logger.warning("outbox dispatcher: redis error, retrying | %s", e)
+            time.sleep(MAX_SLEEP_SECONDS)
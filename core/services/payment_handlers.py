@@ -3,6 +3,7 @@ from __future__ import annotations
 from django.utils import timezone
 
 from core.monobank import mono_invoice_status
+from core.services.sheets_export import enqueue_sheets_export
 
 
 def map_mono_to_local(status_mono: str) -> str:
@@ -53,4 +54,7 @@ def refresh_payment_from_mono(payment) -> bool:
     payment.extra = extra
     payment.last_provider_sync_at = timezone.now()
     payment.save(update_fields=["status", "extra", "last_provider_sync_at", "updated_at"])
+
+    if changed and new_status == "success":
+        enqueue_sheets_export(payment)
     return changed
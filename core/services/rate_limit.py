@@ -0,0 +1,339 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import redis
+from django.conf import settings
+
+from core.services.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Bucket:
+    key: str
+    rate: float  # токенів за секунду
+    burst: float  # місткість відра
+
+
+# KEYS[1] — ключ паузи: поки він живий, нікому не можна слати (повертаємо його PTTL).
+# KEYS[2..] — відра. Атомарно перевіряє всі відра і знімає по токену з кожного,
+# тільки якщо токени є у всіх. Інакше нічого не змінює і повертає, скільки секунд чекати.
+_TOKEN_BUCKET_LUA = """
+local paused = redis.call('PTTL', KEYS[1])
+if paused > 0 then
+  return tostring(paused / 1000)
+end
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local wait = 0
+local tokens = {}
+for i = 2, #KEYS do
+  local rate = tonumber(ARGV[2 * i - 3])
+  local burst = tonumber(ARGV[2 * i - 2])
+  local v = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+  local cur = tonumber(v[1]) or burst
+  local ts = tonumber(v[2]) or now
+  cur = math.min(burst, cur + math.max(0, now - ts) * rate)
+  tokens[i] = cur
+  if cur < 1 then
+    wait = math.max(wait, (1 - cur) / rate)
+  end
+end
+if wait > 0 then
+  return tostring(wait)
+end
+for i = 2, #KEYS do
+  local rate = tonumber(ARGV[2 * i - 3])
+  local burst = tonumber(ARGV[2 * i - 2])
+  redis.call('HSET', KEYS[i], 'tokens', tostring(tokens[i] - 1), 'ts', tostring(now))
+  redis.call('PEXPIRE', KEYS[i], math.ceil(burst / rate * 1000) + 1000)
+end
+return '0'
+"""
+
+# Продовжує паузу до ARGV[1] мс, але ніколи не скорочує вже встановлену.
+_PAUSE_LUA = """
+local ttl = redis.call('PTTL', KEYS[1])
+if ttl < tonumber(ARGV[1]) then
+  redis.call('SET', KEYS[1], '1', 'PX', ARGV[1])
+end
+return 1
+"""
+
+
+class TokenBucketLimiter:
+    """
+    Token bucket зі станом у Redis, спільним для всіх процесів/воркерів.
+    Якщо Redis не налаштований або недоступний — рахує в межах процесу.
+
+    Крім відер є спільна пауза (pause): наприклад, коли API відповіло 429
+    з retry_after, всі відправники чекають, а не бʼються в ліміт далі.
+    """
+
+    LOCAL_MAX_KEYS = 10_000
+
+    def __init__(self, prefix: str) -> None:
+        self.prefix = prefix
+        self.pause_key = f"{prefix}:pause"
+        self._script = None
+        self._pause_script = None
+        self._local: Dict[str, Tuple[float, float]] = {}
+        self._local_pause_until = 0.0
+        self._lock = threading.Lock()
+        self._redis_down = False
+
+    def _on_redis_ok(self) -> None:
+        if self._redis_down:
+            self._redis_down = False
+            logger.info("rate limiter: redis is back | %s", self.prefix)
+
+    def _on_redis_error(self, e: Exception) -> None:
+        if not self._redis_down:
+            self._redis_down = True
+            logger.warning("rate limiter: redis unavailable, using in-process state | %s | %s", self.prefix, e)
+
+    def reserve(self, buckets: Sequence[Bucket]) -> float:
+        """
+        Пробує взяти токен з усіх відер. Повертає 0, якщо вийшло,
+        інакше — скільки секунд почекати перед наступною спробою.
+        """
+        r = get_redis()
+        if r is not None:
+            try:
+                wait = self._reserve_redis(r, buckets)
+                self._on_redis_ok()
+                return wait
+            except redis.RedisError as e:
+                self._on_redis_error(e)
+        return self._reserve_local(buckets)
+
+    def pause(self, seconds: float) -> None:
+        """Зупиняє всі відправки через цей лімітер на `seconds` (не скорочує довшу паузу)."""
+        ms = int(max(0.0, seconds) * 1000)
+        if ms <= 0:
+            return
+        with self._lock:
+            self._local_pause_until = max(self._local_pause_until, time.monotonic() + ms / 1000)
+
+        r = get_redis()
+        if r is None:
+            return
+        try:
+            if self._pause_script is None:
+                self._pause_script = r.register_script(_PAUSE_LUA)
+            self._pause_script(keys=[self.pause_key], args=[ms])
+            self._on_redis_ok()
+        except redis.RedisError as e:
+            self._on_redis_error(e)
+
+    def _reserve_redis(self, r: redis.Redis, buckets: Sequence[Bucket]) -> float:
+        if self._script is None:
+            self._script = r.register_script(_TOKEN_BUCKET_LUA)
+        args = []
+        for b in buckets:
+            args += [b.rate, b.burst]
+        return float(self._script(keys=[self.pause_key] + [b.key for b in buckets], args=args))
+
+    def _reserve_local(self, buckets: Sequence[Bucket]) -> float:
+        now = time.monotonic()
+        with self._lock:
+            if self._local_pause_until > now:
+                return self._local_pause_until - now
+
+            current = []
+            wait = 0.0
+            for b in buckets:
+                tokens, ts = self._local.get(b.key, (b.burst, now))
+                tokens = min(b.burst, tokens + max(0.0, now - ts) * b.rate)
+                current.append(tokens)
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / b.rate)
+            if wait > 0:
+                return wait
+
+            for b, tokens in zip(buckets, current):
+                self._local[b.key] = (tokens - 1, now)
+            if len(self._local) > self.LOCAL_MAX_KEYS:
+                self._prune_local(now, buckets)
+            return 0.0
+
+    def _prune_local(self, now: float, buckets: Sequence[Bucket]) -> None:
+        # повні відра нічим не відрізняються від відсутніх — їх можна викинути
+        max_refill = max(b.burst / b.rate for b in buckets)
+        for key, (_, ts) in list(self._local.items()):
+            if now - ts > max_refill:
+                del self._local[key]
+
+
+class TelegramRateLimiter(TokenBucketLimiter):
+    """
+    Глобальний ліміт бота (OUTBOX_RATE_GLOBAL msg/s) + ліміт на чат (OUTBOX_RATE_PER_CHAT msg/s).
+    Розсилки додатково беруть токен зі спільного відра OUTBOX_RATE_BROADCAST msg/s,
+    тож не можуть зайняти весь глобальний ліміт.
+    """
+
+    KEY_PREFIX = "tg:rl"
+
+    def __init__(
+        self,
+        *,
+        global_rate: Optional[float] = None,
+        chat_rate: Optional[float] = None,
+        broadcast_rate: Optional[float] = None,
+    ) -> None:
+        super().__init__(self.KEY_PREFIX)
+        self.global_rate = global_rate or settings.OUTBOX_RATE_GLOBAL
+        self.chat_rate = chat_rate or settings.OUTBOX_RATE_PER_CHAT
+        self.broadcast_rate = min(self.global_rate, broadcast_rate or settings.OUTBOX_RATE_BROADCAST)
+
+    def buckets_for(self, chat_id: int, *, broadcast: bool = False) -> Tuple[Bucket, ...]:
+        buckets = (
+            Bucket(f"{self.KEY_PREFIX}:global", self.global_rate, self.global_rate),
+            Bucket(f"{self.KEY_PREFIX}:chat:{chat_id}", self.chat_rate, max(1.0, self.chat_rate)),
+        )
+        if broadcast:
+            buckets += (Bucket(f"{self.KEY_PREFIX}:broadcast", self.broadcast_rate, self.broadcast_rate),)
+        return buckets
+
+    async def acquire(self, chat_id: int, *, broadcast: bool = False) -> None:
+        buckets = self.buckets_for(chat_id, broadcast=broadcast)
+        while True:
+            wait = await asyncio.to_thread(self.reserve, buckets)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
+class SheetsRateLimiter(TokenBucketLimiter):
+    """
+    Квота Google Sheets API (SHEETS_REQUESTS_PER_MINUTE запитів на хвилину), спільна для всіх воркерів.
+    На 429/503 ставить спільну паузу, що подвоюється з кожною помилкою підряд
+    (до SHEETS_BACKOFF_MAX_SECONDS) і скидається після першого успішного запиту.
+    """
+
+    KEY_PREFIX = "sheets:rl"
+    # лічильник запитів за поточну хвилину (для headroom) і кількість quota-помилок підряд
+    USED_KEY = "sheets:rl:used:{}"
+    STRIKES_KEY = "sheets:rl:strikes"
+
+    def __init__(self, *, per_minute: Optional[float] = None) -> None:
+        super().__init__(self.KEY_PREFIX)
+        self.per_minute = per_minute or settings.SHEETS_REQUESTS_PER_MINUTE
+        self._local_strikes = 0
+
+    def buckets(self) -> Tuple[Bucket]:
+        # невеликий burst: квота рахується похвилинно, тож рівномірний темп безпечніший
+        return (Bucket(f"{self.KEY_PREFIX}:requests", self.per_minute / 60, max(1.0, self.per_minute / 6)),)
+
+    def acquire(self, max_wait: float) -> bool:
+        """Чекає на дозвіл не довше max_wait секунд. False — квоти зараз немає."""
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self.reserve(self.buckets())
+            if wait <= 0:
+                self._count_request()
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def _count_request(self) -> None:
+        r = get_redis()
+        if r is None:
+            return
+        key = self.USED_KEY.format(int(time.time()) // 60)
+        try:
+            pipe = r.pipeline(transaction=False)
+            pipe.incr(key)
+            pipe.expire(key, 120)
+            pipe.execute()
+        except redis.RedisError as e:
+            self._on_redis_error(e)
+
+    def on_quota_error(self) -> float:
+        """Фіксує quota-помилку і ставить паузу; повертає її тривалість."""
+        strikes = self._local_strikes + 1
+        r = get_redis()
+        if r is not None:
+            try:
+                pipe = r.pipeline(transaction=False)
+                pipe.incr(self.STRIKES_KEY)
+                pipe.expire(self.STRIKES_KEY, int(settings.SHEETS_BACKOFF_MAX_SECONDS * 2))
+                strikes = int(pipe.execute()[0])
+            except redis.RedisError as e:
+                self._on_redis_error(e)
+        self._local_strikes = strikes
+
+        backoff = min(settings.SHEETS_BACKOFF_MAX_SECONDS, settings.SHEETS_BACKOFF_BASE_SECONDS * 2 ** (strikes - 1))
+        self.pause(backoff)
+        logger.warning("sheets quota error | strikes=%s | pause=%ss", strikes, backoff)
+        return backoff
+
+    def on_success(self) -> None:
+        if not self._local_strikes:
+            return
+        self._local_strikes = 0
+        r = get_redis()
+        if r is None:
+            return
+        try:
+            r.delete(self.STRIKES_KEY)
+        except redis.RedisError as e:
+            self._on_redis_error(e)
+
+    def headroom(self) -> Dict[str, Any]:
+        """Скільки запитів до квоти лишилось у поточній хвилині, активна пауза і помилки підряд."""
+        stats: Dict[str, Any] = {
+            "limit_per_min": self.per_minute,
+            "used_this_min": None,
+            "headroom": None,
+            "paused_s": 0.0,
+            "strikes": self._local_strikes,
+        }
+        r = get_redis()
+        if r is None:
+            stats["paused_s"] = round(max(0.0, self._local_pause_until - time.monotonic()), 1)
+            return stats
+        try:
+            pipe = r.pipeline(transaction=False)
+            pipe.get(self.USED_KEY.format(int(time.time()) // 60))
+            pipe.pttl(self.pause_key)
+            pipe.get(self.STRIKES_KEY)
+            used, pttl, strikes = pipe.execute()
+        except redis.RedisError as e:
+            self._on_redis_error(e)
+            return stats
+        used = int(used or 0)
+        stats.update(
+            used_this_min=used,
+            headroom=max(0, int(self.per_minute) - used),
+            paused_s=round(max(0, pttl) / 1000, 1),
+            strikes=int(strikes or 0),
+        )
+        return stats
+
+
+_telegram_limiter: Optional[TelegramRateLimiter] = None
+_sheets_limiter: Optional[SheetsRateLimiter] = None
+
+
+def get_telegram_rate_limiter() -> TelegramRateLimiter:
+    """Один лімітер на процес, щоб in-process fallback памʼятав стан між батчами."""
+    global _telegram_limiter
+    if _telegram_limiter is None:
+        _telegram_limiter = TelegramRateLimiter()
+    return _telegram_limiter
+
+
+def get_sheets_rate_limiter() -> SheetsRateLimiter:
+    global _sheets_limiter
+    if _sheets_limiter is None:
+        _sheets_limiter = SheetsRateLimiter()
+    return _sheets_limiter
@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+import logging
+from typing import Optional
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[redis.Redis] = None
+
+
+def get_redis() -> Optional[redis.Redis]:
+    """
+    Спільний Redis-клієнт процесу (settings.REDIS_URL).
+    Повертає None, якщо Redis не налаштований — тоді викликач
+    має працювати зі своїм in-process fallback.
+    """
+    global _client
+    if not settings.REDIS_URL:
+        return None
+    if _client is None:
+        _client = redis.Redis.from_url(
+            settings.REDIS_URL,
+            socket_timeout=2,
+            socket_connect_timeout=2,
+            health_check_interval=30,
+        )
+    return _client
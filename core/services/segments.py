@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import logging
+from typing import Any, Callable, Dict
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q, QuerySet
+from django.utils import timezone
+
+from core.models import AudienceSegment, Payment, SegmentMembership, Ticket, TgUser
+
+logger = logging.getLogger(__name__)
+
+REFRESH_CHUNK_SIZE = 1000
+
+PAID_STATUS = "success"
+
+
+class SegmentError(ValueError):
+    pass
+
+
+def _event_filter(args: Dict[str, Any]) -> Q:
+    event = args.get("event")
+    if event is None:
+        return Q()
+    if not isinstance(event, int):
+        raise SegmentError(f"event must be an int id, got {event!r}")
+    return Q(event_id=event)
+
+
+def _paid(args: Dict[str, Any]) -> Q:
+    # оплатив (конкретний івент або будь-який)
+    payments = Payment.objects.filter(_event_filter(args), user=OuterRef("pk"), status=PAID_STATUS)
+    return Q(Exists(payments))
+
+
+def _payment_started(args: Dict[str, Any]) -> Q:
+    # створив платіж (будь-який статус) — разом з {"not": {"paid": ...}} дає «почав, але не оплатив»
+    payments = Payment.objects.filter(_event_filter(args), user=OuterRef("pk"))
+    return Q(Exists(payments))
+
+
+def _has_ticket(args: Dict[str, Any]) -> Q:
+    tickets = Ticket.objects.filter(_event_filter(args), user=OuterRef("pk"))
+    return Q(Exists(tickets))
+
+
+def _age(args: Dict[str, Any]) -> Q:
+    q = Q()
+    if "min" in args:
+        q &= Q(age__gte=int(args["min"]))
+    if "max" in args:
+        q &= Q(age__lte=int(args["max"]))
+    if not q:
+        raise SegmentError("age needs min and/or max")
+    return q
+
+
+PREDICATES: Dict[str, Callable[[Dict[str, Any]], Q]] = {
+    "paid": _paid,
+    "payment_started": _payment_started,
+    "has_ticket": _has_ticket,
+    "age": _age,
+}
+
+
+def compile_segment(definition: Any) -> Q:
+    """
+    JSON-визначення сегмента -> Q для TgUser (один SQL-запит з EXISTS-підзапитами).
+
+        {"all": [правило, ...]}   — AND
+        {"any": [правило, ...]}   — OR
+        {"not": правило}
+        {"paid": {"event": 5}}, {"payment_started": {"event": 5}},
+        {"has_ticket": {}}, {"age": {"min": 18, "max": 25}}
+
+    Порожнє визначення ({}) — всі користувачі.
+    """
+    if definition in ({}, None):
+        return Q()
+    if not isinstance(definition, dict) or len(definition) != 1:
+        raise SegmentError(f"rule must be an object with exactly one key, got {definition!r}")
+
+    (op, arg), = definition.items()
+    if op in ("all", "any"):
+        if not isinstance(arg, list) or not arg:
+            raise SegmentError(f"{op} needs a non-empty list of rules")
+        parts = [compile_segment(rule) for rule in arg]
+        q = parts[0]
+        for part in parts[1:]:
+            q = q & part if op == "all" else q | part
+        return q
+    if op == "not":
+        return ~compile_segment(arg)
+    if op in PREDICATES:
+        if not isinstance(arg, dict):
+            raise SegmentError(f"{op} needs an object of arguments")
+        try:
+            return PREDICATES[op](arg)
+        except SegmentError:
+            raise
+        except (TypeError, ValueError) as e:
+            raise SegmentError(f"{op}: {e}") from e
+    raise SegmentError(f"unknown rule {op!r}")
+
+
+def live_segment_users(segment: AudienceSegment) -> QuerySet:
+    return TgUser.objects.filter(compile_segment(segment.definition))
+
+
+def segment_users(segment: AudienceSegment) -> QuerySet:
+    """Користувачі сегмента: з SegmentMembership, якщо сегмент матеріалізований, інакше — живим запитом."""
+    if segment.is_materialized and segment.refreshed_at:
+        return TgUser.objects.filter(segment_memberships__segment=segment)
+    return live_segment_users(segment)
+
+
+def audience_size(segment: AudienceSegment) -> int:
+    if segment.is_materialized and segment.refreshed_at:
+        return segment.member_count
+    return live_segment_users(segment).count()
+
+
+def refresh_segment(segment: AudienceSegment, *, chunk_size: int = REFRESH_CHUNK_SIZE) -> Dict[str, int]:
+    """
+    Оновлює SegmentMembership диффом: видаляє тих, хто вже не підходить (один DELETE
+    з підзапитом), і додає нових шматками по chunk_size. Незмінні рядки не чіпаються.
+    """
+    live = live_segment_users(segment)
+
+    removed, _ = (
+        SegmentMembership.objects
+        .filter(segment=segment)
+        .exclude(user_id__in=live.values("id"))
+        .delete()
+    )
+
+    missing = live.exclude(
+        Exists(SegmentMembership.objects.filter(segment=segment, user=OuterRef("pk")))
+    ).order_by("id")
+    added = 0
+    after_id = 0
+    while True:
+        ids = list(missing.filter(id__gt=after_id).values_list("id", flat=True)[:chunk_size])
+        if not ids:
+            break
+        with transaction.atomic():
+            SegmentMembership.objects.bulk_create(
+                [SegmentMembership(segment=segment, user_id=uid) for uid in ids],
+                ignore_conflicts=True,
+            )
+        added += len(ids)
+        after_id = ids[-1]
+
+    segment.member_count = SegmentMembership.objects.filter(segment=segment).count()
+    segment.refreshed_at = timezone.now()
+    segment.save(update_fields=["member_count", "refreshed_at"])
+
+    logger.info(
+        "segment refreshed | segment_id=%s | added=%s removed=%s total=%s",
+        segment.id, added, removed, segment.member_count,
+    )
+    return {"added": added, "removed": removed, "total": segment.member_count}
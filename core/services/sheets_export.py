@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+import logging
+
+from core.models import Payment, SheetsExportQueue
+
+logger = logging.getLogger(__name__)
+
+
+def is_exportable(payment: Payment) -> bool:
+    # тільки реальна оплата: monobank + amount > 0 (без promo / 100% промо)
+    return (
+        payment.status == "success"
+        and payment.user_id is not None
+        and not payment.exported_to_sheets
+        and payment.provider == "monobank"
+        and payment.amount > 0
+    )
+
+
+def enqueue_sheets_export(payment: Payment) -> bool:
+    """Ставить платіж у SheetsExportQueue, якщо його треба експортувати. Повторний виклик — no-op."""
+    if not is_exportable(payment):
+        return False
+    _, created = SheetsExportQueue.objects.get_or_create(payment=payment)
+    if created:
+        logger.info("sheets export queued | payment_id=%s", payment.id)
+    return created
@@ -1,31 +1,23 @@
 import logging
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
-import requests
 from celery import shared_task
-from django.conf import settings
 from django.db import transaction
 from django.utils import timezone
 
-from telegram.error import RetryAfter, Forbidden, BadRequest, NetworkError, TimedOut
-
 from core.google_sheet import send_registration_to_google_sheets
-from core.models import TgOutboxMessage, Payment, TgUser
+from core.models import AudienceSegment, Payment, TgBroadcast, TgUser
+from core.services.broadcast import enqueue_broadcast
+from core.services.broadcast_delivery import deliver_lazy_broadcasts
+from core.services.outbox import drain_outbox, process_outbox_batch
+from core.services.outbox_archive import archive_outbox_messages
+from core.services.segments import refresh_segment
 
 logger = logging.getLogger(__name__)
 
 SHEETS_FLAG_KEY = "synced_to_sheets_at"
 
 
-def send_telegram_message(token: str, chat_id: int, text: str) -> None:
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
-    r = requests.post(url, json={"chat_id": chat_id, "text": text}, timeout=20)
-    r.raise_for_status()
-    data = r.json()
-    if not data.get("ok"):
-        raise RuntimeError(str(data))
-
-
 @shared_task
 def save_to_sheets_task(data: Dict[str, Any]) -> None:
     """
@@ -34,75 +26,90 @@ def save_to_sheets_task(data: Dict[str, Any]) -> None:
     send_registration_to_google_sheets(data)
 
 
-@shared_task(bind=True, name="core.tasks.outbox_tick", max_retries=5, default_retry_delay=10)
-def outbox_tick(self, limit: int = 200) -> Dict[str, int]:
-    now = timezone.now()
-    msgs = list(
-        TgOutboxMessage.objects
-        .filter(status=TgOutboxMessage.Status.PENDING, run_at__lte=now)
-        .order_by("run_at")[:limit]
-    )
-
-    logger.info("outbox_tick started | pending=%s", len(msgs))
-
-    sent = 0
-    failed = 0
+@shared_task(bind=True, name="core.tasks.outbox_tick")
+def outbox_tick(self, limit: int = 200, max_seconds: Optional[float] = None) -> Dict[str, Any]:
+    """
+    limit — розмір батчу.
+    max_seconds=None — один батч; інакше шле батчі, поки черга не порожня
+    або не вийде час (0 — без обмеження часу).
+    """
+    if max_seconds is None:
+        return process_outbox_batch(limit=limit)
+    return drain_outbox(batch_size=limit, max_seconds=max_seconds)
 
-    for m in msgs:
-        try:
-            send_telegram_message(
-                token=settings.TELEGRAM_BOT_TOKEN,
-                chat_id=m.tg_id,
-                text=m.text
-            )
 
-            m.status = TgOutboxMessage.Status.SENT
-            m.sent_at = timezone.now()
-            m.error = ""
-            m.save(update_fields=["status", "sent_at", "error"])
+@shared_task(bind=True, name="core.tasks.enqueue_broadcast", max_retries=3, default_retry_delay=30)
+def enqueue_broadcast_task(self, broadcast_id: int, trigger: str = "admin_broadcast") -> Dict[str, Any]:
+    """
+    Ставить розсилку в outbox у фоні; прогрес — у TgBroadcast.enqueue_*.
+    Ретрай продовжує з enqueue_cursor, тож вже поставлені шматки не дублюються.
+    Поки ретрай заплановано, статус лишається QUEUED (адмінка не дасть запустити ще раз);
+    FAILED — тільки коли ретраї скінчились.
+    """
+    broadcast = TgBroadcast.objects.get(pk=broadcast_id)
+    try:
+        enqueued = enqueue_broadcast(broadcast, trigger=trigger)
+    except Exception as e:
+        will_retry = self.request.retries < self.max_retries
+        logger.exception(
+            "enqueue_broadcast_task: failed | broadcast_id=%s | will_retry=%s", broadcast_id, will_retry
+        )
+        TgBroadcast.objects.filter(pk=broadcast_id).update(
+            enqueue_status=TgBroadcast.EnqueueStatus.QUEUED if will_retry else TgBroadcast.EnqueueStatus.FAILED,
+            enqueue_error=str(e)[:1000],
+        )
+        raise self.retry(exc=e)
+    if broadcast.delivery_mode == TgBroadcast.DeliveryMode.LAZY:
+        # не чекаємо beat-тіку — починаємо слати одразу
+        deliver_broadcasts.delay()
+    return {"ok": True, "broadcast_id": broadcast_id, "enqueued": enqueued}
 
-            sent += 1
 
-        except RetryAfter as e:
-            wait_for = int(getattr(e, "retry_after", 1))
-            raise self.retry(countdown=wait_for)
+@shared_task(name="core.tasks.deliver_broadcasts")
+def deliver_broadcasts(chunk_size: int = 200, max_seconds: Optional[float] = 55) -> Dict[str, Any]:
+    """Lazy fan-out розсилки (TgBroadcast.DeliveryMode.LAZY)."""
+    return deliver_lazy_broadcasts(chunk_size=chunk_size, max_seconds=max_seconds)
 
-        except (Forbidden, BadRequest) as e:
-            failed += 1
-            m.status = TgOutboxMessage.Status.FAILED
-            m.error = str(e)
-            m.save(update_fields=["status", "error"])
-            logger.warning("Cannot send | outbox_id=%s | %s", m.id, e)
 
-        except (NetworkError, TimedOut) as e:
-            failed += 1
-            m.status = TgOutboxMessage.Status.FAILED
-            m.error = str(e)
-            m.save(update_fields=["status", "error"])
-            logger.warning("Network issue | outbox_id=%s | %s", m.id, e)
+@shared_task(name="core.tasks.refresh_segments")
+def refresh_segments(segment_id: Optional[int] = None) -> Dict[str, Any]:
+    """Оновлює матеріалізовані сегменти (або один, якщо передано segment_id)."""
+    qs = AudienceSegment.objects.filter(is_materialized=True)
+    if segment_id is not None:
+        qs = qs.filter(pk=segment_id)
+    return {s.id: refresh_segment(s) for s in qs}
 
-        except Exception as e:
-            failed += 1
-            m.status = TgOutboxMessage.Status.FAILED
-            m.error = str(e)
-            m.save(update_fields=["status", "error"])
-            logger.exception("Unexpected error | outbox_id=%s | %s", m.id, e)
 
-    logger.info("outbox_tick finished | sent=%s failed=%s", sent, failed)
-    return {"total": len(msgs), "sent": sent, "failed": failed}
+@shared_task(name="core.tasks.archive_outbox")
+def archive_outbox(older_than_days: Optional[int] = None, chunk_size: int = 1000) -> Dict[str, Any]:
+    return archive_outbox_messages(older_than_days=older_than_days, chunk_size=chunk_size)
 
 
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 from celery import shared_task
 from django.utils import timezone
 from django.db import transaction
 import logging
 
-from core.models import Payment, TgUser
-from core.google_sheet import send_registration_to_google_sheets
+from django.conf import settings
+
+from core.models import Payment, SheetsExportQueue, TgUser
+from core.google_sheet import (
+    SheetsQuotaExceeded,
+    event_worksheet_title,
+    invalidate_row_indexes,
+    registration_row,
+    upsert_registrations,
+)
+from core.services.outbox import acquire_slot, release_slot
+from core.services.rate_limit import get_sheets_rate_limiter
 
 logger = logging.getLogger(__name__)
 
+# один експорт за раз; TTL — з запасом на очікування квоти, якщо воркер впаде з локом
+SHEETS_EXPORT_LOCK_KEY = "sheets:export:{}"
+SHEETS_EXPORT_LOCK_TTL = 600
+
 
 @shared_task(
     bind=True,
@@ -113,48 +120,53 @@ logger = logging.getLogger(__name__)
 def sync_paid_users_to_sheets(self, limit: int = 200) -> Dict[str, Any]:
     """
     Раз на хвилину:
-    - бере Payment зі status=success
-    - user != null
-    - exported_to_sheets=False
-    - ТІЛЬКИ реальна оплата (monobank + amount > 0)  ✅
-    - додає юзера в Google Sheets
-    - ставить exported_to_sheets=True
+    - бере до limit записів з SheetsExportQueue (туди потрапляють тільки реальні
+      оплати monobank + amount > 0 у момент переходу в success)
+    - додає юзерів у Google Sheets
+    - ставить exported_to_sheets=True і видаляє записи з черги
+    Вартість пропорційна новим продажам, а не розміру таблиці Payment.
+    Одночасно працює тільки один експорт (Redis-лок): інакше два запуски взяли б
+    ті самі записи черги і обидва дописали б той самий платіж.
     """
+    slot, token = acquire_slot(SHEETS_EXPORT_LOCK_KEY, 1, SHEETS_EXPORT_LOCK_TTL)
+    if slot is None:
+        logger.info("sync_paid_users_to_sheets: skipped, another export is running")
+        return {"ok": True, "skipped": True, "total": 0, "synced": 0, "failed": 0}
+    try:
+        return _sync_paid_users_to_sheets(limit)
+    finally:
+        release_slot(slot, token)
 
-    # Якщо ти хочеш тільки "реальні" платежі:
-    base_qs = (
-        Payment.objects
-        .select_related("user", "event")
-        .filter(
-            status="success",
-            user__isnull=False,
-            exported_to_sheets=False,
 
-            provider="monobank",   # ✅ прибирає promo / тестові провайдери
-            amount__gt=0,          # ✅ прибирає 100% промо з amount=0
-        )
-        # .filter(event__is_active=True)  # ✅ якщо треба тільки активні івенти
-        .order_by("id")
-    )
+def _sync_paid_users_to_sheets(limit: int) -> Dict[str, Any]:
+    base_qs = SheetsExportQueue.objects.order_by("id")
 
     # Якщо Postgres — краще так (без дубля при паралельних воркерах):
     try:
         with transaction.atomic():
-            payments: List[Payment] = list(
-                base_qs.select_for_update(skip_locked=True)[:limit]
-            )
+            queued = list(base_qs.select_for_update(skip_locked=True).values_list("id", "payment_id")[:limit])
     except Exception:
         # fallback для SQLite/MySQL без skip_locked
-        payments = list(base_qs[:limit])
+        queued = list(base_qs.values_list("id", "payment_id")[:limit])
+
+    payments: List[Payment] = list(
+        Payment.objects
+        .select_related("user", "event")
+        .filter(id__in=[payment_id for _, payment_id in queued], exported_to_sheets=False, user__isnull=False)
+        .order_by("id")
+    )
+    if len(payments) < len(queued):
+        # вже експортовані / без юзера — з черги просто прибираємо
+        keep = {p.id for p in payments}
+        SheetsExportQueue.objects.filter(id__in=[qid for qid, pid in queued if pid not in keep]).delete()
 
     total = len(payments)
     if total == 0:
         logger.info("sync_paid_users_to_sheets: nothing to sync")
         return {"ok": True, "total": 0, "synced": 0, "failed": 0}
 
-    synced = 0
-    failed = 0
-
+    # кожен івент — свій аркуш; групуємо, щоб батчі йшли в аркуш незалежно
+    rows_by_sheet: Dict[Optional[str], List[tuple]] = {}
     for p in payments:
         u: TgUser = p.user
 
@@ -169,29 +181,58 @@ def sync_paid_users_to_sheets(self, limit: int = 200) -> Dict[str, Any]:
             "payment_id": p.id,
             "paid_at": (p.updated_at or timezone.now()).strftime("%Y-%m-%d %H:%M:%S"),
         }
+        title = event_worksheet_title(p.event_id)
+        rows_by_sheet.setdefault(title, []).append((p.id, registration_row(payload)))
 
-        try:
-            send_registration_to_google_sheets(payload)
-
-            p.exported_to_sheets = True
-            p.save(update_fields=["exported_to_sheets"])
-
-            synced += 1
+    synced = 0
+    chunk_size = max(1, settings.SHEETS_APPEND_CHUNK_ROWS)
+    # індекс payment_id -> рядок перечитуємо раз на запуск (один col_values на аркуш):
+    # між запусками аркуш могли доповнити інші воркери або відсортувати вручну
+    invalidate_row_indexes()
+
+    # один upsert (append_rows / batch_update) на шматок і один UPDATE на шматок замість запиту + save() на кожен платіж.
+    # Якщо шматок впав — він і решта рядків цього аркуша лишаються exported_to_sheets=False до наступного запуску;
+    # інші аркуші експортуються далі. Без квоти зупиняємось повністю.
+    quota_exhausted = False
+    for title, rows in rows_by_sheet.items():
+        if quota_exhausted:
+            break
+        sheet = title or "sheet1"
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            ids = [payment_id for payment_id, _ in chunk]
+            try:
+                upsert_registrations([row for _, row in chunk], title)
+            except SheetsQuotaExceeded as e:
+                # квоти немає — решту дошлемо наступним запуском, коли мине пауза
+                quota_exhausted = True
+                logger.warning(
+                    "sync_paid_users_to_sheets: quota exhausted | sheet=%s | left=%s | %s",
+                    sheet, total - synced, e
+                )
+                break
+            except Exception as e:
+                logger.exception(
+                    "sync_paid_users_to_sheets: batch failed | sheet=%s | payment_ids=%s..%s | left=%s | %s",
+                    sheet, ids[0], ids[-1], len(rows) - start, e
+                )
+                break
+
+            with transaction.atomic():
+                Payment.objects.filter(id__in=ids).update(exported_to_sheets=True)
+                SheetsExportQueue.objects.filter(payment_id__in=ids).delete()
+            synced += len(ids)
             logger.info(
-                "sync_paid_users_to_sheets: synced | payment_id=%s tg_id=%s",
-                p.id, u.tg_id
+                "sync_paid_users_to_sheets: synced batch | sheet=%s | payment_ids=%s..%s | rows=%s",
+                sheet, ids[0], ids[-1], len(ids)
             )
 
-        except Exception as e:
-            failed += 1
-            logger.exception(
-                "sync_paid_users_to_sheets: failed | payment_id=%s | %s",
-                p.id, e
-            )
+    failed = total - synced
 
+    quota = get_sheets_rate_limiter().headroom()
     logger.info(
-        "sync_paid_users_to_sheets: done | total=%s synced=%s failed=%s",
-        total, synced, failed
+        "sync_paid_users_to_sheets: done | total=%s synced=%s failed=%s | quota_used=%s headroom=%s paused=%ss",
+        total, synced, failed, quota["used_this_min"], quota["headroom"], quota["paused_s"]
     )
 
-    return {"ok": True, "total": total, "synced": synced, "failed": failed}
+    return {"ok": True, "total": total, "synced": synced, "failed": failed, "quota": quota}
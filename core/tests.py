@@ -0,0 +1,42 @@
+import unittest
+from datetime import timedelta
+
+from django.db import connection
+from django.db.models import Q
+from django.test import TestCase
+from django.utils import timezone
+
+from core.models import TgOutboxMessage
+from core.services.outbox import claim_candidates, claimable_q
+
+
+@unittest.skipUnless(connection.vendor == "sqlite", "план перевіряється у форматі EXPLAIN QUERY PLAN SQLite")
+class OutboxClaimQueryPlanTests(TestCase):
+    """Claim-запит має йти по частковому індексу pending-рядків, скільки б sent не накопичилось."""
+
+    INDEX = "outbox_pending_prio_run_at_idx"
+
+    def _bulk(self, n: int, status: str, run_at) -> None:
+        TgOutboxMessage.objects.bulk_create(
+            [
+                TgOutboxMessage(tg_id=i, trigger="test", text="x", status=status, run_at=run_at)
+                for i in range(n)
+            ],
+            batch_size=1000,
+        )
+
+    def _claim_plan(self) -> str:
+        claimable = claimable_q(timezone.now()) & Q(priority=TgOutboxMessage.Priority.TRIGGERED)
+        return claim_candidates(claimable).values_list("id", flat=True)[:200].explain()
+
+    def test_claim_uses_pending_index_as_table_grows(self):
+        past = timezone.now() - timedelta(minutes=1)
+        self._bulk(50, TgOutboxMessage.Status.PENDING, past)
+
+        for _ in range(3):
+            self._bulk(10_000, TgOutboxMessage.Status.SENT, past)
+            plan = self._claim_plan()
+            self.assertIn(f"USING INDEX {self.INDEX}", plan)
+            self.assertNotIn("SCAN core_tgoutboxmessage", plan)
+            # ORDER BY run_at теж з індексу, без окремого сортування
+            self.assertNotIn("TEMP B-TREE", plan)
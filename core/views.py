@@ -17,7 +17,7 @@ from rest_framework.response import Response
 from typing import Any
 
 from .google_sheet import send_registration_to_google_sheets
-from .models import TgUser, Event, Payment, Ticket, EventMessageTemplate, TgOutboxMessage, PromoCode
+from .models import TgUser, Event, Payment, Ticket, EventMessageTemplate, TgOutboxMessage, TgOutboxArchive, PromoCode
 from .monobank import mono_create_invoice, verify_mono_webhook_signature
 from .serializers import (
     TgUserSerializer,
@@ -28,7 +28,9 @@ from .serializers import (
     PaymentSerializer,
     TicketSerializer,
 )
+from .services.outbox_scheduler import notify_outbox_scheduled
 from .services.payment_handlers import refresh_payment_from_mono
+from .services.sheets_export import enqueue_sheets_export
 from .ticket import generate_ticket
 
 logger = logging.getLogger(__name__)
@@ -59,6 +61,9 @@ def tg_check_user(request):
 
     if not user:
         return Response({"ok": True, "exists": False, "user": None})
+    if user.bot_blocked_at:
+        # юзер знову пише боту — отже, розблокував
+        TgUser.objects.filter(id=user.id).update(bot_blocked_at=None)
     return Response({"ok": True, "exists": True, "user": TgUserSerializer(user).data})
 
 
@@ -82,6 +87,7 @@ def tg_create_user(request):
     if not created:
         for f in ("username", "full_name", "age", "phone", "email"):
             setattr(user, f, data.get(f, getattr(user, f)))
+        user.bot_blocked_at = None
         user.save()
     #
     # _safe_send_to_sheets(
@@ -547,6 +553,7 @@ def mono_webhook(request):
     extra["mono_status"] = status_mono
     extra["mono_modifiedDate"] = modified_date
 
+    old_status = payment.status
     if status_mono in MonoWebhookStatus.SUCCESS:
         payment.status = "success"
         if getattr(payment, "promo_code_id", None):
@@ -562,6 +569,9 @@ def mono_webhook(request):
     payment.updated_at = timezone.now()
     payment.save(update_fields=["status", "extra", "updated_at"])
 
+    if payment.status == "success" and old_status != "success":
+        enqueue_sheets_export(payment)
+
     return Response({"ok": True})
 
 
@@ -578,7 +588,14 @@ def trigger_event_messages(request):
     templates = EventMessageTemplate.objects.filter(event=event, trigger=trigger, is_enabled=True)
     now = timezone.now()
 
-    TgOutboxMessage.objects.bulk_create(
+    dedup_keys = {tpl.id: TgOutboxMessage.make_dedup_key(event.id, tg_id, trigger, tpl.id) for tpl in templates}
+    # вже відправлені й перенесені в архів (archive_outbox) — у живій черзі їх ключа більше немає
+    archived = set(
+        TgOutboxArchive.objects.filter(dedup_key__in=dedup_keys.values()).values_list("dedup_key", flat=True)
+    )
+
+    # повторний виклик (ретрай бота, подвійний клік) упреться в unique dedup_key і нічого не додасть
+    messages = TgOutboxMessage.objects.bulk_create(
         [
             TgOutboxMessage(
                 tg_id=tg_id,
@@ -586,10 +603,15 @@ def trigger_event_messages(request):
                 trigger=trigger,
                 text=tpl.text,
                 run_at=now + timezone.timedelta(seconds=tpl.delay_seconds),
+                priority=TgOutboxMessage.priority_for_trigger(trigger),
+                dedup_key=dedup_keys[tpl.id],
             )
             for tpl in templates
-        ]
+            if dedup_keys[tpl.id] not in archived
+        ],
+        ignore_conflicts=True,
     )
+    notify_outbox_scheduled(m.run_at for m in messages)
 
     return Response({"ok": True})
 
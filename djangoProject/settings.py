@@ -42,10 +42,45 @@ QR_BASE_URL=BASE_BACKEND_URL
 BOT_USERNAME = 'prml_event_bot'
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 
-CELERY_BROKER_URL = os.getenv("REDIS_URL")
-CELERY_RESULT_BACKEND = os.getenv("REDIS_URL")
+REDIS_URL = os.getenv("REDIS_URL")
+CELERY_BROKER_URL = REDIS_URL
+CELERY_RESULT_BACKEND = REDIS_URL
 CELERY_TIMEZONE = "Europe/Vienna"
 CELERY_TASK_ALWAYS_EAGER = False
+
+# Outbox (TgOutboxMessage) sender
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "20"))
+OUTBOX_HTTP_TIMEOUT = float(os.getenv("OUTBOX_HTTP_TIMEOUT", "20"))
+# скільки секунд claimed-повідомлення належить воркеру, перш ніж його зможе забрати інший
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "300"))
+# тимчасові помилки (мережа, 429, 5xx) повторюються з backoff; після MAX_ATTEMPTS — статус dead
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))
+OUTBOX_RETRY_BASE_SECONDS = float(os.getenv("OUTBOX_RETRY_BASE_SECONDS", "30"))
+OUTBOX_RETRY_MAX_SECONDS = float(os.getenv("OUTBOX_RETRY_MAX_SECONDS", "3600"))
+# скільки drain-циклів (outbox_tick / process_outbox) може працювати одночасно
+OUTBOX_MAX_DRAINERS = int(os.getenv("OUTBOX_MAX_DRAINERS", "2"))
+# повідомлення в один чат, чиї run_at різняться не більше ніж на стільки секунд,
+# склеюються в одне (до 4096 символів); 0 — вимкнено
+OUTBOX_COALESCE_WINDOW = float(os.getenv("OUTBOX_COALESCE_WINDOW", "0"))
+# частка батчу для кожного TgOutboxMessage.Priority: transactional / triggered / broadcast
+OUTBOX_LANE_WEIGHTS = {0: 6, 1: 3, 2: 1}
+# sent/failed/dead/cancelled старші за стільки днів переносяться в TgOutboxArchive (нічна задача archive_outbox)
+OUTBOX_ARCHIVE_AFTER_DAYS = int(os.getenv("OUTBOX_ARCHIVE_AFTER_DAYS", "14"))
+# ліміти Telegram: ~30 msg/s на бота і ~1 msg/s в один чат
+OUTBOX_RATE_GLOBAL = float(os.getenv("OUTBOX_RATE_GLOBAL", "30"))
+OUTBOX_RATE_PER_CHAT = float(os.getenv("OUTBOX_RATE_PER_CHAT", "1"))
+# стеля для розсилок (lazy fan-out і broadcast-смуга outbox) всередині глобального ліміту:
+# решта OUTBOX_RATE_GLOBAL завжди лишається транзакційним / тригерним повідомленням
+OUTBOX_RATE_BROADCAST = float(os.getenv("OUTBOX_RATE_BROADCAST", "20"))
+# Google Sheets: скільки рядків максимум в одному append_rows (один запит = одна одиниця квоти)
+SHEETS_APPEND_CHUNK_ROWS = int(os.getenv("SHEETS_APPEND_CHUNK_ROWS", "100"))
+# квота Sheets API на запис (60/хв на сервісний акаунт) і backoff на 429/503
+SHEETS_REQUESTS_PER_MINUTE = float(os.getenv("SHEETS_REQUESTS_PER_MINUTE", "60"))
+SHEETS_BACKOFF_BASE_SECONDS = float(os.getenv("SHEETS_BACKOFF_BASE_SECONDS", "5"))
+SHEETS_BACKOFF_MAX_SECONDS = float(os.getenv("SHEETS_BACKOFF_MAX_SECONDS", "300"))
+# скільки максимум чекати на квоту перед запитом, перш ніж відкласти експорт до наступного запуску
+SHEETS_MAX_WAIT_SECONDS = float(os.getenv("SHEETS_MAX_WAIT_SECONDS", "20"))
+
 from celery.schedules import crontab
 
 CELERY_BEAT_SCHEDULE = {
@@ -115,10 +150,25 @@ WSGI_APPLICATION = 'djangoProject.wsgi.application'
 from celery.schedules import crontab
 
 CELERY_BEAT_SCHEDULE = {
+    # кожна хвилина — цикл, що шле батчами до 55с або поки черга не порожня
     "outbox-tick-1m": {
         "task": "core.tasks.outbox_tick",
         "schedule": crontab(minute="*/1"),
-        "args": (200,),
+        "kwargs": {"limit": 200, "max_seconds": 55},
+    },
+    # lazy fan-out розсилки: отримувачі перебираються під час відправки
+    "deliver-broadcasts-1m": {
+        "task": "core.tasks.deliver_broadcasts",
+        "schedule": crontab(minute="*/1"),
+        "kwargs": {"chunk_size": 200, "max_seconds": 55},
+    },
+    "refresh-segments-15m": {
+        "task": "core.tasks.refresh_segments",
+        "schedule": crontab(minute="*/15"),
+    },
+    "archive-outbox-daily": {
+        "task": "core.tasks.archive_outbox",
+        "schedule": crontab(hour=3, minute=30),
     },
     "sync-paid-users-to-sheets-1m": {
         "task": "core.tasks.sync_paid_users_to_sheets",
@@ -197,4 +247,8 @@ LOGGING = {
         "handlers": ["console"],
         "level": "INFO",
     },
+    "loggers": {
+        # httpx логує кожен запит разом з URL, а в URL Telegram API є токен бота
+        "httpx": {"level": "WARNING"},
+    },
 }